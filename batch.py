@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+#evolution for several configurations in parallel worker processes,
+#one output per configuration and a summary table at the end
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from ctypes import CDLL
+from multiprocessing import Pool
+
+sys.path.append("./python")
+from beam_lib import delete_sim, evolve_fit, make_sim
+from read_con import read_con
+
+#_____________________________________________________________________________
+def main():
+
+    parser = argparse.ArgumentParser(description="Bunch overlap evolution for a list of configurations")
+    parser.add_argument("cards", nargs="+", help="configuration files or glob patterns, e.g. 'cards/*.ini'")
+    parser.add_argument("-p", "--nproc", type=int, default=0, help="worker processes, 0 for one per core")
+    parser.add_argument("-j", "--nthreads", type=int, default=1, help="threads in each worker, 0 for all cores")
+    parser.add_argument("-o", "--outdir", default="batch", help="directory for the outputs")
+    add_evolution_args(parser)
+    args = parser.parse_args()
+
+    #configurations from the names and patterns, in the given order
+    cards = []
+    for i in args.cards:
+        for card in sorted(glob.glob(i)) or [i]:
+            if card not in cards:
+                cards.append(card)
+
+    tasks = [(card, nam, {}, args) for card, nam in zip(cards, output_names(cards))]
+
+    run_tasks(tasks, args)
+
+#main
+
+#_____________________________________________________________________________
+def output_names(cards):
+
+    #names for the outputs from the card file names, for cards with the same
+    #file name the parent directories are prefixed until the names are unique
+
+    paths = [os.path.splitext(os.path.abspath(card))[0].split(os.sep) for card in cards]
+    ndir = [1]*len(cards)
+
+    while True:
+        names = ["_".join(p[-n:]) for p, n in zip(paths, ndir)]
+        dup = [i for i, nam in enumerate(names) if names.count(nam) > 1 and ndir[i] < len(paths[i])]
+        if not dup:
+            break
+        for i in dup:
+            ndir[i] += 1
+
+    #numbered if still the same
+    return [nam+"_"+str(names[:i].count(nam)) if names.count(nam) > 1 else nam for i, nam in enumerate(names)]
+
+#output_names
+
+#_____________________________________________________________________________
+def add_evolution_args(parser):
+
+    #options for the evolution, shared with run.py scan
+
+    parser.add_argument("--tmin", type=float, default=-0.6, help="start of the evolution (ns)")
+    parser.add_argument("--tmax", type=float, default=0.6, help="end of the evolution (ns)")
+    parser.add_argument("--nstep", type=int, default=200, help="number of steps")
+    parser.add_argument("--auto", action="store_true", help="time window from the bunches, tmin and tmax are not used")
+    parser.add_argument("--frac", type=float, default=0.5, help="fraction of uniform steps with --auto")
+    parser.add_argument("--checkpoint", type=int, default=0, help="steps between checkpoints in the output directory, 0 for none")
+    parser.add_argument("--fit", action="store_true", help="Gaussian fits to the time integrals, to fit.json in the output directory")
+    parser.add_argument("--no-output", action="store_true", help="no ROOT output for the configurations, summary only")
+
+#add_evolution_args
+
+#_____________________________________________________________________________
+def run_tasks(tasks, args):
+
+    #tasks (card, name, options set over the card, args) in the worker processes,
+    #summary and metrics in the output directory
+
+    os.makedirs(args.outdir, exist_ok=True)
+
+    nproc = args.nproc if args.nproc > 0 else os.cpu_count()
+    nproc = min(nproc, len(tasks))
+
+    with Pool(nproc) as pool:
+        res = pool.map(run_card, tasks, chunksize=1)
+
+    summary(res, os.path.join(args.outdir, "summary.txt"))
+
+    #timers and counters for all configurations
+    with open(os.path.join(args.outdir, "metrics.json"), "w") as f:
+        json.dump({i["card"]: i.get("metrics") for i in res}, f, indent=2)
+
+    #Gaussian fits made in the workers
+    if args.fit:
+        with open(os.path.join(args.outdir, "fit.json"), "w") as f:
+            json.dump({i["card"]: i.get("fit") for i in res}, f, indent=2)
+
+    return res
+
+#run_tasks
+
+#_____________________________________________________________________________
+def run_card(task):
+
+    #evolution for one configuration in a worker process
+
+    card, nam, over, args = task
+
+    #ROOT output, none when only the summary is needed
+    out = None if args.no_output else os.path.join(args.outdir, nam+".root")
+
+    res = {"card": nam, "out": out}
+
+    try:
+        cf = read_con(card)
+
+        #options replaced in the card
+        for key in over:
+            cf.con.set("main", key, str(over[key]))
+
+        lib = CDLL("build/libeic_beam_shape.so")
+
+        start = time.time()
+
+        sim = make_sim(lib, cf, args.nthreads)
+
+        #checkpoint next to the output, a new batch continues from it
+        if args.checkpoint > 0:
+            ckpt = os.path.join(args.outdir, nam+".ckpt")
+            lib.sim_set_checkpoint(sim, ckpt.encode(), args.checkpoint)
+
+        ev = evolve_fit(lib, cf, sim, args.tmin, args.tmax, args.nstep, args.auto, args.frac,
+            out=out, fit=args.fit)
+
+        delete_sim(lib, sim)
+
+        res["time"] = time.time() - start
+        res["stat"] = ev["stat"]
+        res["metrics"] = ev["metrics"]
+        res["fit"] = {ax: ev["fit_"+ax] for ax in ["x", "y", "z"] if "fit_"+ax in ev}
+
+    except Exception as e:
+        res["error"] = str(e)
+
+    return res
+
+#run_card
+
+#_____________________________________________________________________________
+def summary(res, out):
+
+    #table of the time integrals for all configurations
+
+    #name column wide enough for all configurations
+    w = max([24]+[len(i["card"]) for i in res])
+
+    head = "{0:<{w}} {1:>9} {2:>12} {3:>10} {4:>10} {5:>10} {6:>10} {7:>10} {8:>10}".format(
+        "card", "time (s)", "pairs", "mu_x (mm)", "sig_x (mm)", "mu_y (um)", "sig_y (um)", "mu_z (mm)", "sig_z (mm)", w=w)
+
+    lines = [head, "-"*len(head)]
+    for i in res:
+
+        if "error" in i:
+            lines.append( "{0:<{w}} failed: {1}".format(i["card"], i["error"], w=w) )
+            continue
+
+        sx, sy, sz = i["stat"]
+        lines.append( "{0:<{w}} {1:>9.1f} {2:>12.1f} {3:>10.4f} {4:>10.4f} {5:>10.4f} {6:>10.4f} {7:>10.2f} {8:>10.2f}".format(
+            i["card"], i["time"], sz[0], sx[1], sx[2], sy[1]*1e3, sy[2]*1e3, sz[1], sz[2], w=w) )
+
+    table = "\n".join(lines)
+
+    print(table)
+
+    with open(out, "w") as f:
+        f.write(table+"\n")
+
+#summary
+
+#_____________________________________________________________________________
+if __name__ == "__main__":
+
+    main()
+
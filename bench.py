@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+#timing of bunch generation, move, pairs, evolution and fit for the cards,
+#at several particle counts and bin counts, results in JSON
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from ctypes import CDLL, c_double, c_ulong, c_void_p
+
+sys.path.append("./python")
+from beam_lib import delete_sim, make_sim, sim_integral, sim_ranges
+from gaus_fit import arr_to_np, fit_gaus
+from read_con import read_con
+
+#_____________________________________________________________________________
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark for the bunch overlap simulation")
+    parser.add_argument("cards", nargs="*", default=["cards/*.ini"], help="configuration files or glob patterns")
+    parser.add_argument("--np-scale", default="1,4", help="comma separated factors for the particle counts in the cards")
+    parser.add_argument("--bins", default="60,120", help="comma separated number of bins along each axis")
+    parser.add_argument("-j", "--nthreads", type=int, default=0, help="threads, 0 for all cores")
+    parser.add_argument("--nstep", type=int, default=50, help="steps in the evolution")
+    parser.add_argument("--nrep", type=int, default=20, help="repetitions for move and pairs")
+    parser.add_argument("--repeat", type=int, default=3, help="repeats of each measurement, the fastest is taken")
+    parser.add_argument("-o", "--out", default="bench.json", help="output JSON file")
+    args = parser.parse_args()
+
+    cards = []
+    for i in args.cards:
+        for card in sorted(glob.glob(i)) or [i]:
+            if card not in cards:
+                cards.append(card)
+
+    np_scale = [float(i) for i in args.np_scale.split(",")]
+    bins = [int(i) for i in args.bins.split(",")]
+
+    lib = CDLL("build/libeic_beam_shape.so")
+    lib.make_bunch_gen.restype = c_void_p
+    lib.sim_get_bunch.restype = c_void_p
+
+    results = []
+    for card in cards:
+        for scale in np_scale:
+            for nbin in bins:
+
+                res = bench_card(lib, card, scale, nbin, args)
+                results.append(res)
+
+                print("{0:<24} np x{1:<4g} bins {2:<4d}".format(res["card"], scale, nbin),
+                    " ".join("{0}: {1:.4f}".format(k, res[k]) for k in res if k.startswith("t_")))
+
+    out = {"commit": git_commit(), "host": platform.node(), "machine": platform.machine(),
+        "ncpu": os.cpu_count(), "nthreads": args.nthreads, "nstep": args.nstep, "nrep": args.nrep,
+        "repeat": args.repeat, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+
+    with open(args.out, "w") as f:
+        json.dump(out, f, indent=2)
+
+    print("Results written to", args.out)
+
+#main
+
+#_____________________________________________________________________________
+def bench_card(lib, card, scale, nbin, args):
+
+    #times in seconds for one card, particle count scale and number of bins
+
+    cf = read_con(card)
+
+    e_np = int(cf.int("e_np")*scale)
+    p_np = int(cf.int("p_np")*scale)
+
+    #the card with the particle counts and bins for the benchmark
+    cf.con.set("main", "e_np", str(e_np))
+    cf.con.set("main", "p_np", str(p_np))
+    for ax in ["nx", "ny", "nz"]:
+        cf.con.set("main", ax, str(nbin))
+
+    res = {"card": os.path.splitext(os.path.basename(card))[0], "e_np": e_np, "p_np": p_np, "nbins": nbin}
+
+    #generation of the two bunches
+    def gen():
+        for i in ["e", "p"]:
+            b = c_void_p( lib.make_bunch_gen(cf.int(i+"_np"), cf(i+"_rmsx"), cf(i+"_bsx"), cf(i+"_rmsy"), cf(i+"_bsy"), cf(i+"_rmsz"), c_ulong(1), args.nthreads) )
+            lib.bunch_delete(b)
+
+    res["t_make_bunch"] = timeit(gen, args.repeat)
+
+    #complete setup of the simulation, generation and first binning
+    res["t_setup"] = timeit(lambda: delete_sim(lib, make_sim(lib, cf, args.nthreads)), args.repeat)
+
+    sim = make_sim(lib, cf, args.nthreads)
+    b = c_void_p( lib.sim_get_bunch(sim, 0) )
+
+    #bunch move with the fill of its density, back and forth
+    def move():
+        for i in range(args.nrep):
+            lib.bunch_move(b, c_double(0.01))
+            lib.bunch_move(b, c_double(-0.01))
+
+    res["t_move"] = timeit(move, args.repeat)/(2*args.nrep)
+
+    #pairs for the bunches at the present position
+    def pairs():
+        for i in range(args.nrep):
+            lib.sim_make_pairs(sim)
+
+    res["t_pairs"] = timeit(pairs, args.repeat)/args.nrep
+
+    delete_sim(lib, sim)
+
+    #evolution with output to a temporary file, on a fresh simulation each time
+    with tempfile.TemporaryDirectory() as tmp:
+
+        out = os.path.join(tmp, "sim.root").encode()
+        ts = []
+        for i in range(args.repeat):
+
+            if i > 0:
+                delete_sim(lib, sim)
+
+            sim = make_sim(lib, cf, args.nthreads)
+            lib.sim_set_out(sim, out)
+
+            start = time.perf_counter()
+            lib.sim_run_evolution(sim, c_double(-0.6), c_double(0.6), args.nstep)
+            ts.append( time.perf_counter()-start )
+
+        res["t_evolution"] = min(ts)
+
+    #Gaussian fits to the time integrals in x, y and z
+    vals = [sim_integral(lib, sim, ia) for ia in range(3)]
+    ranges = sim_ranges(lib, sim)
+
+    def fit():
+        for ia in range(3):
+            edges, content = arr_to_np(vals[ia], *ranges[ia])
+            fit_gaus(edges, content, [0, 10] if ia == 2 else None)
+
+    res["t_fit"] = timeit(fit, args.repeat)
+
+    delete_sim(lib, sim)
+
+    return res
+
+#bench_card
+
+#_____________________________________________________________________________
+def timeit(func, repeat):
+
+    #fastest of repeated calls, seconds
+
+    ts = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        ts.append( time.perf_counter()-start )
+
+    return min(ts)
+
+#timeit
+
+#_____________________________________________________________________________
+def git_commit():
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+#git_commit
+
+#_____________________________________________________________________________
+if __name__ == "__main__":
+
+    main()
+
@@ -4,14 +4,20 @@
 //bunch representation
 
 #include <vector>
+#include <string>
+#include <cstdio>
 #include "TH3D.h"
+#include "density.h"
+#include "metrics.h"
 class TVector3;
+class TRandom3;
 
 class bunch {
 
   public:
 
-    bunch(int npart, double rmsx, double bsx, double rmsy, double bsy, double rmsz);
+    bunch(int npart, double rmsx, double bsx, double rmsy, double bsy, double rmsz, unsigned long seed=4357, int nthr=1,
+      const char *cache_dir=0, double cache_mb=0, int sampler=0);
 
     void rotate_y(double a);
     void set_color(Color_t col) {gr.SetMarkerColor(col);}
@@ -19,9 +25,45 @@ class bunch {
     void set_bins(int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax);
 
     void set_kinematics(double en, double m, double dx, double dy, double dz);
+    void set_hourglass();
+    bool get_hourglass() { return !tx.empty(); }
     void move(double dt);
 
-    TH3D& get_hxyz() { return hxyz; }
+    void set_shift(int n) { nsub = n; }
+    int get_shift() { return nsub; }
+    void set_single(bool s) { dens.set_single(s); }
+    void set_nthreads(int n) { nthr = n; }
+    void sync_points();
+
+    const sim_metrics& get_metrics();
+    void reset_metrics(bool all);
+
+    void write_state(FILE *f);
+    bool read_state(FILE *f);
+
+    density& get_dens() { return dens; }
+
+    int get_bin_lo(int ia) { return blo[ia]; }
+    int get_bin_hi(int ia) { return bhi[ia]; }
+
+    void get_zrange(double& zlo, double& zhi);
+    void get_extent(double dt, double *lo, double *hi);
+
+    int get_np() { return px.size(); }
+    const std::string& get_key() { return genkey; }
+    void set_intensity(double n) { intensity = n; }
+    double get_intensity() { return intensity; }
+    double *get_x() { return px.data(); }
+    double *get_y() { return py.data(); }
+    double *get_z() { return pz.data(); }
+
+    double get_sx() { return sx; }
+    double get_sy() { return sy; }
+    double get_sz() { return sz; }
+    double get_tilt() { return tilt; }
+    double get_vel() { return vel; }
+    const TVector3& get_dir() { return dir; }
+    const TVector3& get_cen() { return cen; }
 
     void print();
     void draw();
@@ -30,13 +72,61 @@ class bunch {
 
   private:
 
-    std::vector<TVector3> points; // particles in bunch
+    void generate_all(unsigned long seed, int sampler);
+    void generate(int i0, int i1, unsigned int rseed);
+    void generate_sobol(int i0, int i1, const unsigned int *shift);
+    static double norm_trunc(double u, double sig, double smax);
+    static double gaus_trunc(TRandom3& rnd, double sig, double smax);
+    static unsigned int block_seed(unsigned long seed, int iblk);
+
+    static const int gen_block = 4096; // particles in one random stream
+
+    void generate_slopes(int i0, int i1, unsigned int rseed);
+    void propagate(double dx, double dy, double dz, double ds);
+
+    void fill_dens();
+    void clear_dens();
+
+    void make_ref();
+    void fill_shift();
+    void shift_edges(int ia, double d, std::vector<int>& ie, std::vector<double>& fe);
+
+    std::vector<double> px, py, pz; // particles in bunch, coordinates stored as contiguous arrays
+    std::vector<int> ixp, iyp, izp; // bins along x, y and z for each particle, used in the fill
+    std::vector<int> pord; // particles ordered by the bin along x, used in the fill
+    TVector3 cen_pts; // bunch center for present particle coordinates
+
+    //shifted binning, density made once in bunch frame and translated with the bunch
+    int nsub; // fine bins per bin along each axis, zero to fill from particles at each move
+    std::vector<float> sat; // summed-volume table of fine bins, exact for counts below 2^24
+    int nf[3]; // number of fine bins along x, y and z
+    int kf0[3]; // index of first fine bin from the lower edge of the binning
+    TVector3 cen_ref; // bunch center when the table was made
+
     TGraph gr; // graph xz representation
-    TH3D hxyz; // particle distribution in x, y and z
+    density dens; // particle distribution in x, y and z
+    TH3D hxyz; // distribution for drawing
+    int blo[3], bhi[3]; // range of occupied bins along x, y and z, including underflow and overflow
+
+    double sx, sy, sz; // Gaussian widths in x, y and z, mm
+    double betx, bety; // beta* h/v, mm
+    unsigned long gseed; // seed for the generation
+    std::string genkey; // generation parameters and seed, key in the cache
+
+    //hourglass, particles move along the bunch direction with their own transverse slopes
+    std::vector<double> tx, ty; // slopes in x and y for each particle, empty for rigid moves
+    double tilt; // rotation along y, rad
+    TVector3 cen; // position of bunch center, mm
+
+    double intensity; // particles in the real bunch, number of simulated particles by default
 
     double vel; // velocity in mm/ns
     TVector3 dir; // direction unit vector
 
+    int nthr; // number of threads, all cores for zero
+
+    sim_metrics met; // timers and counters
+
 };
 
 #endif
@@ -0,0 +1,28 @@
+#ifndef bunch_cache_h
+#define bunch_cache_h
+
+//on-disk cache of generated bunch particles
+
+#include <string>
+
+class bunch_cache {
+
+  public:
+
+    bunch_cache(const char *dir, double size_mb);
+
+    bool read(const std::string& key, int np, double *x, double *y, double *z);
+    void write(const std::string& key, int np, const double *x, const double *y, const double *z);
+
+  private:
+
+    std::string file_name(const std::string& key);
+    void evict(const std::string& keep);
+
+    std::string dir; // cache directory
+    long max_size; // limit for all entries in the directory, bytes
+
+};
+
+#endif
+
@@ -0,0 +1,114 @@
+#ifndef density_h
+#define density_h
+
+//particle density on a 3D grid stored in bricks of 8x8x8 bins,
+//only the bricks with particles are allocated
+
+#include <vector>
+#include <cstddef>
+
+class TH3D;
+
+class density {
+
+  public:
+
+    density();
+
+    void set_bins(int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax);
+    void set_single(bool s);
+
+    void reset();
+    void clear();
+
+    //brick for the bin to be allocated by alloc
+    void mark(int ix, int iy, int iz) {
+      size_t k = bidx(ix>>bsh, iy>>bsh, iz>>bsh);
+      if( brk[k] < 0 ) {
+        brk[k] = used.size();
+        used.push_back(k);
+      }
+    }
+    void alloc();
+    void alloc_box(const int *lo, const int *hi);
+
+    //bin index along axis ia, same as TAxis::FindBin, 0 for underflow, n+1 for overflow
+    int find_bin(int ia, double v) const {
+      if( v < vmin[ia] ) return 0;
+      if( !(v < vmax[ia]) ) return nbin[ia]+1;
+      return 1 + int( nbin[ia]*(v-vmin[ia])/(vmax[ia]-vmin[ia]) );
+    }
+
+    //position of a bin in the storage, the brick must be allocated, z is the fastest index
+    size_t idx(int ix, int iy, int iz) const {
+      size_t b = brk[bidx(ix>>bsh, iy>>bsh, iz>>bsh)];
+      return (b<<(3*bsh)) + (((ix&bmask)<<bsh | (iy&bmask))<<bsh | (iz&bmask));
+    }
+
+    void add(int ix, int iy, int iz) {
+      if( single ) {
+        fval[idx(ix, iy, iz)] += 1;
+      } else {
+        dval[idx(ix, iy, iz)] += 1;
+      }
+    }
+
+    void set(int ix, int iy, int iz, double v) {
+      if( single ) {
+        fval[idx(ix, iy, iz)] = v;
+      } else {
+        dval[idx(ix, iy, iz)] = v;
+      }
+    }
+
+    double get(int ix, int iy, int iz) const {
+      if( brk[bidx(ix>>bsh, iy>>bsh, iz>>bsh)] < 0 ) return 0;
+      return single ? fval[idx(ix, iy, iz)] : dval[idx(ix, iy, iz)];
+    }
+
+    //bins along z in brick bz at ix and iy, null for brick not allocated
+    template<typename T> const T *row(int ix, int iy, int bz) const {
+      int b = brk[bidx(ix>>bsh, iy>>bsh, bz)];
+      if( b < 0 ) return nullptr;
+      return values<T>() + ((size_t)b<<(3*bsh)) + (((ix&bmask)<<bsh | (iy&bmask))<<bsh);
+    }
+
+    int get_nbins(int ia) const { return nbin[ia]; }
+    double get_min(int ia) const { return vmin[ia]; }
+    double get_max(int ia) const { return vmax[ia]; }
+    double get_width(int ia) const { return (vmax[ia]-vmin[ia])/nbin[ia]; }
+
+    bool is_single() const { return single; }
+    int get_nbricks() const { return used.size(); }
+    size_t get_mem() const;
+
+    void fill_th3(TH3D& h) const;
+
+    static const int bsh = 3; // bins along each axis in a brick as power of 2
+    static const int bsiz = 1<<bsh; // bins along each axis in a brick
+    static const int bmask = bsiz-1;
+
+  private:
+
+    size_t bidx(int bx, int by, int bz) const { return ((size_t)bx*nbrk[1] + by)*nbrk[2] + bz; }
+
+    template<typename T> const T *values() const;
+
+    int nbin[3]; // number of bins along x, y and z
+    double vmin[3], vmax[3]; // range along x, y and z
+
+    int nbrk[3]; // bricks along x, y and z, covering also underflow and overflow
+    std::vector<int> brk; // brick position in the storage, -1 for brick not allocated
+    std::vector<int> used; // allocated bricks in order of the storage
+
+    bool single; // single precision storage
+    std::vector<double> dval; // bin contents in allocated bricks, double precision
+    std::vector<float> fval; // bin contents in single precision
+
+};
+
+template<> inline const double *density::values<double>() const { return dval.data(); }
+template<> inline const float *density::values<float>() const { return fval.data(); }
+
+#endif
+
@@ -0,0 +1,43 @@
+#ifndef gaus_overlap_h
+#define gaus_overlap_h
+
+//analytic overlap of two Gaussian bunches
+
+#include "TH1D.h"
+
+class bunch;
+
+class gaus_overlap {
+
+  public:
+
+    gaus_overlap();
+
+    void set_bins(int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax);
+
+    void run(bunch *b0, bunch *b1, double tmin, double tmax);
+
+    double get_total() { return total; }
+
+    void write(const char *nam);
+
+    TH1D& get_hxt() { return hxt; }
+    TH1D& get_hyt() { return hyt; }
+    TH1D& get_hzt() { return hzt; }
+
+    void draw_xt() { hxt.Draw(); }
+    void draw_yt() { hyt.Draw(); }
+    void draw_zt() { hzt.Draw(); }
+
+  private:
+
+    void make_amat(bunch *b, double *amat);
+
+    TH1D hxt, hyt, hzt; // time integrals of overlap along x, y and z
+
+    double total; // overlap integral over space and time, mm^-2
+
+};
+
+#endif
+
@@ -0,0 +1,57 @@
+#ifndef metrics_h
+#define metrics_h
+
+//timers and counters for the simulation phases
+
+#include <chrono>
+
+//_____________________________________________________________________________
+struct sim_metrics {
+
+  //same layout in python/beam_lib.py
+
+  double t_gen; // generation of bunch particles or read from cache, s
+  double t_fill; // density fill in bunches, s
+  double t_pairs; // pairs from the densities, s
+  double t_io; // output and checkpoints, s
+  long n_fill; // particles put to the densities
+  long n_in; // particles inside the bin range
+  long n_over; // particles in underflow or overflow bins
+  long n_bins; // bins visited for the pairs
+  long n_bins_pairs; // visited bins with nonzero pairs
+  long n_step; // steps in the evolution
+  long n_cross; // bunch pairs processed for the pairs
+  long mem_part; // bytes allocated for particles in bunches
+  long mem_dens; // bytes allocated for bunch densities
+  long mem_pairs; // bytes allocated for the pairs distributions and time integrals
+
+};
+
+//_____________________________________________________________________________
+inline double metrics_now() {
+
+  //wall-clock time in seconds
+
+  return std::chrono::duration<double>( std::chrono::steady_clock::now().time_since_epoch() ).count();
+
+}//metrics_now
+
+//_____________________________________________________________________________
+class metrics_timer {
+
+  //adds the time from construction to destruction to the given timer
+
+  public:
+
+    metrics_timer(double& t): acc(t), start(metrics_now()) {}
+    ~metrics_timer() { acc += metrics_now() - start; }
+
+  private:
+
+    double& acc;
+    double start;
+
+};
+
+#endif
+
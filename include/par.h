@@ -0,0 +1,151 @@
+#ifndef par_h
+#define par_h
+
+//parallel loop over an index range
+
+#include <thread>
+#include <vector>
+#include <mutex>
+#include <condition_variable>
+#include <functional>
+#include <unistd.h>
+
+//_____________________________________________________________________________
+inline int par_nthreads(int nthr) {
+
+  //number of threads to use, all cores for nthr < 1
+
+  if( nthr > 0 ) return nthr;
+
+  int ncore = std::thread::hardware_concurrency();
+
+  return ncore > 0 ? ncore : 1;
+
+}//par_nthreads
+
+//_____________________________________________________________________________
+class par_pool {
+
+  //persistent worker threads, tasks 0 <= i < ntask are shared among
+  //the workers and the calling thread
+
+  public:
+
+    par_pool(int nwork): task(0), ntask(0), inext(0), ndone(0), gen(0), stop(false) {
+      for(int i=0; i<nwork; i++) workers.push_back( std::thread(&par_pool::work, this) );
+    }
+
+    ~par_pool() {
+      {
+        std::lock_guard<std::mutex> lock(mtx);
+        stop = true;
+      }
+      cv_task.notify_all();
+      for(auto& i: workers) i.join();
+    }
+
+    void run(int n, const std::function<void(int)>& func) {
+
+      //one loop at a time from the calling threads
+      std::lock_guard<std::mutex> run_lock(run_mtx);
+
+      std::unique_lock<std::mutex> lock(mtx);
+      task = &func;
+      ntask = n;
+      inext = 0;
+      ndone = 0;
+      gen++;
+      cv_task.notify_all();
+
+      process(lock);
+      cv_done.wait(lock, [this]{ return ndone == ntask; });
+      task = 0;
+    }
+
+    static bool& in_task() { static thread_local bool flag = false; return flag; }
+
+  private:
+
+    void process(std::unique_lock<std::mutex>& lock) {
+      //take tasks until none is left, lock is held outside of the task calls
+      while( task and inext < ntask ) {
+        int i = inext++;
+        const std::function<void(int)> *func = task;
+        lock.unlock();
+        in_task() = true;
+        (*func)(i);
+        in_task() = false;
+        lock.lock();
+        if( ++ndone == ntask ) cv_done.notify_all();
+      }
+    }
+
+    void work() {
+      std::unique_lock<std::mutex> lock(mtx);
+      long seen = 0;
+      while( true ) {
+        cv_task.wait(lock, [this, &seen]{ return stop or gen != seen; });
+        if( stop ) return;
+        seen = gen;
+        process(lock);
+      }
+    }
+
+    std::vector<std::thread> workers;
+    std::mutex run_mtx, mtx;
+    std::condition_variable cv_task, cv_done;
+    const std::function<void(int)> *task;
+    int ntask, inext, ndone;
+    long gen;
+    bool stop;
+
+};
+
+//_____________________________________________________________________________
+inline par_pool& par_get_pool() {
+
+  //pool with a worker for each core, made again in a forked process
+  //where the threads of the parent don't exist (old pool is left unused)
+
+  static par_pool *pool = 0;
+  static pid_t owner = 0;
+  static std::mutex mtx;
+
+  std::lock_guard<std::mutex> lock(mtx);
+
+  if( !pool or owner != getpid() ) {
+    pool = new par_pool(par_nthreads(0)-1);
+    owner = getpid();
+  }
+
+  return *pool;
+
+}//par_get_pool
+
+//_____________________________________________________________________________
+template<typename F> void par_for(int n, int nthr, F func) {
+
+  //call func(ith, i0, i1) for contiguous ranges i0 <= i < i1 covering 0 <= i < n,
+  //one range per task ith, the ranges depend only on n and nthr
+
+  nthr = par_nthreads(nthr);
+  if( nthr > n ) nthr = n;
+
+  //serial for one range or when called from inside another parallel loop
+  if( nthr <= 1 or par_pool::in_task() ) {
+    for(int ith=0; ith<nthr; ith++) {
+      func(ith, (long)n*ith/nthr, (long)n*(ith+1)/nthr);
+    }
+    return;
+  }
+
+  std::function<void(int)> task = [&func, n, nthr](int ith) {
+    func(ith, (long)n*ith/nthr, (long)n*(ith+1)/nthr);
+  };
+
+  par_get_pool().run(nthr, task);
+
+}//par_for
+
+#endif
+
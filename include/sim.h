@@ -3,6 +3,11 @@
 
 //simulation
 
+#include <string>
+#include <cstdint>
+
+#include "metrics.h"
+
 #include "TH1D.h"
 #include "TH2D.h"
 
@@ -12,37 +17,127 @@ class sim {
 
     sim();
 
-    void add_bunch(bunch *b) { bunches.push_back(b); }
+    void add_bunch(bunch *b, int side=-1, double toff=0);
     void move(double dt);
 
+    void set_shift(int nsub);
+    void set_single(bool single);
+    void set_nthreads(int n);
+    void set_kernel(int k) { kernel = k; }
+    void set_adaptive(int n) { ncoarse = n; }
+
     void set_bins(int nx=60, double xmin=-2, double xmax=2, int ny=60, double ymin=-2, double ymax=2, int nz=60,
       double zmin=-200, double zmax=200);
 
     void run_evolution(double tmin, double tmax, int nstep);
+    void run_schedule(const double *times, int nt, double *xy_out, double *z_out);
+    void run_auto(int nstep, double frac=0.5);
+    double run_gaus(double tmin, double tmax);
+
+    void write(const char *nam);
+    void set_out(const char *nam) { outnam = nam; } // no output for empty name
+    void set_checkpoint(const char *nam, int every) { cknam = nam; ckevery = every; }
+
+    void get_stats(int ia, double *stat);
+    std::vector<double>& get_integral(int ia) { return ia == 0 ? vxt : (ia == 1 ? vyt : vzt); }
+
+    void make_pairs();
+
+    double get_time() { return tcur; }
+    void get_nbins(int *n) { for(int ia=0; ia<3; ia++) n[ia] = nbin[ia]; }
+    void get_ranges(double *lo, double *hi) { for(int ia=0; ia<3; ia++) { lo[ia] = bmin[ia]; hi[ia] = bmax[ia]; } }
+
+    void get_metrics(sim_metrics& m);
+    void reset_metrics();
+
+    typedef void (*progress_func)(int istep, int nstep, double time);
+    void set_progress(progress_func f) { progress = f; }
 
     void draw();
     bunch *get_bunch(int id) { return bunches[id]; }
+    int get_nbunch() { return bunches.size(); }
     void draw_xy();
     void draw_z();
 
-    void draw_xt() { hxt.Draw(); }
-    void draw_yt() { hyt.Draw(); }
-    void draw_zt() { hzt.Draw(); }
+    void draw_xt();
+    void draw_yt();
+    void draw_zt();
 
-    int get_hzmax() { return hz.GetMaximum(); }
+    int get_hzmax();
 
   private:
 
-    void make_pairs();
+    //extent in z of a bunch along time, and a crossing of two bunches in trains
+    struct ztrack {
+      double v; // velocity along z, mm/ns
+      double zlo, zhi; // extent in z at zero time, mm
+    };
+    struct crossing {
+      double t_in, t_out; // time window where the bunches overlap within the bins, ns
+      int i0, i1; // hadron and electron bunch
+    };
+
+    bool trains() { return bunches.size() > 2; }
+    void make_schedule();
+    bool pair_window(const ztrack& b0, const ztrack& b1, double& t_in, double& t_out);
+    void add_crossing(const crossing& c);
+    void add_pairs(bunch *b0, bunch *b1);
+    void auto_train(int nstep, std::vector<double>& tlo, std::vector<double>& thi);
+
+    void accumulate(double w);
+    double step_weight(double dt, double dt_ref);
+    double lumi_norm(bunch *b0, bunch *b1);
+    void first_pair(bunch*& b0, bunch*& b1);
+    bool crossing_window(bunch *b0, bunch *b1, double& tmin, double& tmax, double& tc, double& sigt);
+    void pilot_ranges(double *vlo, double *vhi);
+
+    void write_checkpoint(int mode, const std::vector<double>& par, int istep, double tnow);
+    bool read_checkpoint(int mode, const std::vector<double>& par, int& istep, double& tnow);
+    void end_checkpoint();
+    uint64_t config_hash();
+    void fill_h1(TH1D& h, const std::vector<double>& v);
 
     std::vector<bunch*> bunches; // bunches in simulation
 
+    //bunch trains, hadron bunches on side 0 and electron bunches on side 1,
+    //each bunch is moved only when it is in a crossing
+    std::vector<int> side; // side of each bunch
+    std::vector<double> tb; // time of the present state of each bunch, ns
+    std::vector<crossing> sched; // crossings ordered by t_in
+    std::vector<crossing> sched_open; // crossings without a finite window, bunches at rest in z
+    double sched_len; // longest finite crossing window, ns
+
+    //pairs on flat arrays with underflow and overflow bins
+    int nbin[3]; // number of bins along x, y and z
+    double bmin[3], bmax[3]; // bin ranges along x, y and z, mm
+    int ncoarse; // bins along each axis in the pilot for the bin ranges, ranges as given for zero
+    std::vector<double> vxy; // pairs distribution in x and y, y is the fastest index
+    std::vector<double> vz; // pairs distribution in z
+    std::vector< std::vector<double> > vz_part; // partial sums in z for each slice along x
+    std::vector<double> vxt, vyt, vzt; // time integrals in pairs along x, y and z
+
+    //histograms made from the arrays for drawing and output
     TH2D hxy; // pairs distribution in x and y
     TH1D hz; // pairs distribution in z
     TH1D hxt, hyt, hzt; // time integrals in pairs along x, y and z
 
     double xymax; // initial maximum in xy
 
+    double tcur; // present time of the bunches, ns
+
+    int nthr; // number of threads, all cores for zero
+
+    int kernel; // pairs as minimum of the counts for 0, luminosity from product of densities for 1
+
+    std::string outnam; // output from the evolution
+
+    std::string cknam; // checkpoint file, none for empty name
+    int ckevery; // steps between checkpoints
+    uint64_t ckhash; // configuration of the evolution, checked when resuming
+
+    sim_metrics met; // timers and counters for pairs, output and steps
+    progress_func progress; // called at each step if set
+
 };
 
 #endif
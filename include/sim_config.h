@@ -0,0 +1,61 @@
+#ifndef sim_config_h
+#define sim_config_h
+
+//configuration for a complete simulation with the electron and proton/nucleus bunches
+
+class sim;
+
+//_____________________________________________________________________________
+struct sim_config {
+
+  //same layout in python/beam_lib.py, units as in the cards
+
+  double cross_angle; // crossing angle, mrad
+  double y_angle; // vertical angle of proton/nucleus bunch, urad
+
+  double Ee; // electron beam energy, GeV
+  double Ep; // proton beam energy, GeV
+  int A; // nucleus mass number, 1 for proton
+  int Z; // nucleus charge, 1 for proton
+
+  int e_np; // simulated particles in electron bunch
+  double e_rmsx, e_rmsy; // RMS emittance h/v, nm
+  double e_bsx, e_bsy; // beta* h/v, cm
+  double e_rmsz; // RMS bunch length, cm
+
+  int p_np; // simulated particles in proton/nucleus bunch
+  double p_rmsx, p_rmsy;
+  double p_bsx, p_bsy;
+  double p_rmsz;
+
+  unsigned long seed; // random seed, 2*seed and 2*seed+1 for the two bunches
+  int sampler; // particles from pseudo-random numbers for 0, from scrambled Sobol points for 1
+  int nthreads; // number of threads, all cores for zero
+
+  int nsub; // shifted binning with nsub fine bins per bin, zero for fill at each move
+  int single; // single precision for bunch densities
+  int hourglass; // particles with transverse slopes from the emittance and beta*, rigid bunches for zero
+
+  int kernel; // pairs as minimum of the counts in bins for 0, luminosity from product of densities for 1
+  double e_int, p_int; // particles in real electron and proton/nucleus bunch, simulated particles for zero
+
+  int nbunch; // bunches in electron and in proton/nucleus train, single crossing for 1
+  double spacing; // time between bunches in a train, ns
+  double int_spread; // relative RMS spread of bunch intensities in the trains, of simulated particles for the min kernel
+
+  int nx, ny, nz; // number of bins along x, y and z
+  double xmin, xmax, ymin, ymax, zmin, zmax; // bin ranges, mm
+  int adaptive; // bins along each axis in the coarse pilot for the ranges around the overlap, ranges as given for zero
+
+  const char *cache_dir; // cache for generated particles, none for null
+  double cache_size; // cache size limit, MB
+
+  const char *checkpoint; // checkpoint for the evolution, none for null
+  int checkpoint_every; // steps between checkpoints
+
+};
+
+sim *sim_from_config(const sim_config& c);
+
+#endif
+
@@ -1,32 +1,210 @@
 #!/usr/bin/python3
 
-from ROOT import TFile
+#Gaussian fits to the time integrals in x, y and z from the simulation outputs,
+#sim.root files or .npz from run.py evolve; many files are fitted in parallel
+#worker processes to one table, the plots are made from the table as a separate step
 
-from pandas import DataFrame
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+
+from pandas import DataFrame, read_csv
 from scipy.stats import norm
 from scipy.optimize import curve_fit
 import numpy as np
 import collections
 
-import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+from gaus_fit import arr_to_np, fit_integral
+
+#histograms for the axes in the outputs, start for the fit in z
+axes = [("x", "hxt", None), ("y", "hyt", None), ("z", "hzt", [0, 10])]
 
 #_____________________________________________________________________________
 def main():
 
-    iplot = 3
-    funclist = []
-    funclist.append( fit_x ) # 0
-    funclist.append( fit_y ) # 1
-    funclist.append( fit_z ) # 2
-    funclist.append( fit_xyz ) # 3
+    parser = argparse.ArgumentParser(description="Gaussian fits to the time integrals in x, y and z")
+    parser.add_argument("inputs", nargs="*", help="sim.root or .npz outputs, default ../sim.root with plot to 01fig.pdf")
+    parser.add_argument("-o", "--out", default="fit.csv", help="table of the fits")
+    parser.add_argument("-p", "--nproc", type=int, default=0, help="worker processes, 0 for one per core")
+    parser.add_argument("--plot", action="store_true", help="plots for the inputs in the table, to <input>_fit.pdf")
+    parser.add_argument("--from-table", action="store_true", help="plots only, from existing table given by --out")
+    args = parser.parse_args()
+
+    #single local output as before
+    if len(args.inputs) == 0 and not args.from_table:
+        fit_xyz()
+        return
+
+    if not args.from_table:
+        fit_files(args.inputs, args.out, args.nproc)
+
+    if args.plot or args.from_table:
+        plot_table(args.out)
+
+#main
+
+#_____________________________________________________________________________
+def fit_files(inputs, out, nproc=0):
+
+    #fits for all inputs and axes in worker processes, one row per input and axis
+
+    if nproc < 1:
+        nproc = os.cpu_count()
+    nproc = max(1, min(nproc, len(inputs)))
+
+    with Pool(nproc) as pool:
+        res = pool.map(fit_file, inputs, chunksize=1)
+
+    tab = DataFrame([row for rows in res for row in rows],
+        columns=["file", "axis", "mu", "mu_err", "sigma", "sigma_err", "sum", "error"])
+
+    tab.to_csv(out, index=False, float_format="%.8g")
+
+    print(tab.drop(columns="error").to_string(index=False))
+    for i in tab[tab["error"] != ""].itertuples():
+        print("Fit failed for", i.file, i.axis+":", i.error)
+    print("Table written to", out)
+
+    return tab
+
+#fit_files
+
+#_____________________________________________________________________________
+def fit_file(nam):
+
+    #fits in x, y and z for one input, in a worker process
+
+    rows = []
+
+    try:
+        dist = read_integrals(nam)
+    except Exception as e:
+        return [{"file": nam, "axis": ax, "error": str(e)} for ax, hnam, p0 in axes]
+
+    for ax, hnam, p0 in axes:
+
+        row = {"file": nam, "axis": ax, "error": ""}
+
+        try:
+            val, xmin, xmax = dist[ax]
+            row.update( fit_integral(val, xmin, xmax, p0) )
+        except Exception as e:
+            row["error"] = str(e)
+
+        rows.append(row)
+
+    return rows
+
+#fit_file
+
+#_____________________________________________________________________________
+def read_integrals(nam):
+
+    #time integrals with underflow and overflow and the axis ranges,
+    #dictionary by axis name, the contents are read in bulk
+
+    dist = {}
+
+    if nam.endswith(".npz"):
+
+        with np.load(nam) as inp:
+            for ax, hnam, p0 in axes:
+                edges = inp["edges_"+ax]
+                dist[ax] = (inp[hnam], edges[0], edges[-1])
+
+        return dist
+
+    from ROOT import TFile
+
+    inp = TFile.Open(nam)
+    if not inp or inp.IsZombie():
+        raise IOError("Can't open "+nam)
+
+    for ax, hnam, p0 in axes:
+        dist[ax] = h1_to_arr(inp.Get(hnam))
+
+    inp.Close()
+
+    return dist
+
+#read_integrals
+
+#_____________________________________________________________________________
+def h1_to_arr(hx):
+
+    #contents of TH1 including underflow and overflow as a NumPy copy, and the axis range
+
+    nbins = hx.GetNbinsX()
+
+    buf = hx.GetArray()
+    buf.reshape((nbins+2,))
+
+    return np.array(buf, dtype=np.float64), hx.GetXaxis().GetXmin(), hx.GetXaxis().GetXmax()
+
+#h1_to_arr
+
+#_____________________________________________________________________________
+def plot_table(tab_nam):
+
+    #Gaussian fits in x, y and z over the data for each input in the table,
+    #one figure with three panels per input
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    tab = read_csv(tab_nam)
+    tab["error"] = tab["error"].fillna("")
+
+    for nam, rows in tab.groupby("file", sort=False):
 
-    funclist[iplot]()
+        try:
+            dist = read_integrals(nam)
+        except Exception as e:
+            print("No plot for", nam+":", e)
+            continue
+
+        fig, axs = plt.subplots(1, 3, figsize=(18, 5))
+
+        for ax, (iax, hnam, p0) in zip(axs, axes):
+
+            row = rows[rows["axis"] == iax].iloc[0]
+
+            edges, content = arr_to_np(*dist[iax])
+            plot_np_step(ax, edges, content, "blue")
+
+            ax.set_xlabel("$"+iax+"$ (mm)")
+            ax.set_ylabel("Normalized counts")
+            set_grid(ax, "black")
+
+            if row["error"] != "":
+                ax.set_title("Fit failed")
+                continue
+
+            centers = 0.5*(edges[1:] + edges[:-1])
+            x = np.linspace(centers[0], centers[-1], 300)
+            ax.plot(x, norm.pdf(x, row["mu"], row["sigma"]), "-", color="red")
+
+            ax.set_title("$\\mu_{0}$ = {1:.4g} $\\pm$ {2:.2g}, $\\sigma_{0}$ = {3:.4g} $\\pm$ {4:.2g} (mm)".format(
+                iax, row["mu"], row["mu_err"], row["sigma"], row["sigma_err"]))
+            ax.set_ylim([0, None])
+
+        out = os.path.splitext(nam)[0]+"_fit.pdf"
+        fig.savefig(out, bbox_inches = "tight")
+        plt.close(fig)
+
+        print("Plot written to", out)
+
+#plot_table
 
 #_____________________________________________________________________________
 def fit_x(nam=None, out="01fig.pdf", title=None):
 
+    from ROOT import TFile
+    import matplotlib.pyplot as plt
+
     if nam is None:
         #nam = "../sim_noy.root"
         #nam = "../sim_y.root"
@@ -90,6 +268,9 @@ def fit_x(nam=None, out="01fig.pdf", title=None):
 #_____________________________________________________________________________
 def fit_y(nam=None, out="01fig.pdf", title=None):
 
+    from ROOT import TFile
+    import matplotlib.pyplot as plt
+
     if nam is None:
         #nam = "../sim_noy.root"
         #nam = "../sim_y.root"
@@ -152,6 +333,9 @@ def fit_y(nam=None, out="01fig.pdf", title=None):
 #_____________________________________________________________________________
 def fit_z(nam=None, out="01fig.pdf", title=None):
 
+    from ROOT import TFile
+    import matplotlib.pyplot as plt
+
     if nam is None:
         #nam = "../sim_noy.root"
         #nam = "../sim_y.root"
@@ -248,25 +432,9 @@ def fit_xyz():
 #_____________________________________________________________________________
 def h1_to_np(hx):
 
-    #bin edges and content from TH1
-
-    edges = np.zeros(hx.GetNbinsX()+1)
-    content = np.zeros(hx.GetNbinsX())
-    hsum = 0.
-    nbins = hx.GetNbinsX()
-    for i in range(nbins):
-        edges[i] = hx.GetBinLowEdge(i)
-        content[i] = hx.GetBinContent(i)
-        hsum += content[i]
-
-    #upper edge of last bin
-    edges[nbins] = hx.GetBinLowEdge(nbins-1) + hx.GetBinWidth(nbins-1)
-
-    #normalize the content to density
-    for i in range(len(content)):
-        content[i] = content[i]/(hsum*(edges[1]-edges[0]))
+    #bin edges and content from TH1, read in bulk
 
-    return edges, content
+    return arr_to_np(*h1_to_arr(hx))
 
 #h1_to_np
 
@@ -326,14 +494,17 @@ class legend:
 
 #_____________________________________________________________________________
 def leg_lin(col, sty="-"):
+    from matplotlib.lines import Line2D
     return Line2D([0], [0], lw=2, ls=sty, color=col)
 
 #_____________________________________________________________________________
 def leg_txt():
+    from matplotlib.lines import Line2D
     return Line2D([0], [0], lw=0)
 
 #_____________________________________________________________________________
 def leg_dot(fig, col, siz=8):
+    from matplotlib.lines import Line2D
     return Line2D([0], [0], marker="o", color=fig.get_facecolor(), markerfacecolor=col, markersize=siz)
 
 #_____________________________________________________________________________
@@ -0,0 +1,350 @@
+
+#ctypes interface to libeic_beam_shape
+
+#NumPy is imported in the functions which use it, for fast start of compute-only runs
+
+from ctypes import CFUNCTYPE, POINTER, Structure, byref, c_double, c_char_p, c_int, c_long, c_ulong, c_void_p
+
+#_____________________________________________________________________________
+class sim_metrics(Structure):
+
+    #timers (s) and counters, same layout as sim_metrics in include/metrics.h
+
+    _fields_ = [("t_gen", c_double), ("t_fill", c_double), ("t_pairs", c_double), ("t_io", c_double),
+        ("n_fill", c_long), ("n_in", c_long), ("n_over", c_long), ("n_bins", c_long), ("n_bins_pairs", c_long),
+        ("n_step", c_long), ("n_cross", c_long), ("mem_part", c_long), ("mem_dens", c_long), ("mem_pairs", c_long)]
+
+#sim_metrics
+
+#_____________________________________________________________________________
+class sim_config(Structure):
+
+    #configuration for sim_setup, same layout as sim_config in include/sim_config.h
+
+    _fields_ = [("cross_angle", c_double), ("y_angle", c_double), ("Ee", c_double), ("Ep", c_double),
+        ("A", c_int), ("Z", c_int),
+        ("e_np", c_int), ("e_rmsx", c_double), ("e_rmsy", c_double), ("e_bsx", c_double), ("e_bsy", c_double), ("e_rmsz", c_double),
+        ("p_np", c_int), ("p_rmsx", c_double), ("p_rmsy", c_double), ("p_bsx", c_double), ("p_bsy", c_double), ("p_rmsz", c_double),
+        ("seed", c_ulong), ("sampler", c_int), ("nthreads", c_int), ("nsub", c_int), ("single", c_int), ("hourglass", c_int),
+        ("kernel", c_int), ("e_int", c_double), ("p_int", c_double),
+        ("nbunch", c_int), ("spacing", c_double), ("int_spread", c_double),
+        ("nx", c_int), ("ny", c_int), ("nz", c_int),
+        ("xmin", c_double), ("xmax", c_double), ("ymin", c_double), ("ymax", c_double), ("zmin", c_double), ("zmax", c_double),
+        ("adaptive", c_int),
+        ("cache_dir", c_char_p), ("cache_size", c_double), ("checkpoint", c_char_p), ("checkpoint_every", c_int)]
+
+#sim_config
+
+#overlap kernels in sim, pairs as minimum of the counts in bins or luminosity
+#from product of the densities
+kernels = {"min": 0, "product": 1}
+
+#samplers for the bunch particles, pseudo-random or scrambled Sobol points
+samplers = {"random": 0, "sobol": 1}
+
+#progress callback, called with step index, number of steps and time in ns
+progress_func = CFUNCTYPE(None, c_int, c_int, c_double)
+
+#callbacks passed to the library, kept while the simulations may call them
+_progress = {}
+
+#_____________________________________________________________________________
+def bunch_xyz(lib, b):
+
+    #particle coordinates x, y and z as NumPy views on the arrays in the bunch,
+    #no copy is made, the views follow the bunch as it moves and are valid
+    #as long as the bunch exists; with shifted binning (nsub) the particles
+    #are translated only at this call, call again after moving the bunch
+
+    lib.bunch_get_xyz.restype = c_int
+    lib.bunch_get_xyz.argtypes = [c_void_p, POINTER(POINTER(c_double)), POINTER(POINTER(c_double)), POINTER(POINTER(c_double))]
+
+    import numpy as np
+
+    x = POINTER(c_double)()
+    y = POINTER(c_double)()
+    z = POINTER(c_double)()
+
+    npart = lib.bunch_get_xyz(b, byref(x), byref(y), byref(z))
+
+    if npart == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+
+    return tuple(np.ctypeslib.as_array(i, shape=(npart,)) for i in (x, y, z))
+
+#bunch_xyz
+
+#_____________________________________________________________________________
+def _option_value(cf, nam, values):
+
+    #value in the dictionary values for option nam in the card cf,
+    #error with the allowed names for a name not in the dictionary
+
+    val = cf.str(nam)
+    if val not in values:
+        raise ValueError("Invalid "+nam+" '"+val+"' in the card, allowed values: "+", ".join(values))
+
+    return values[val]
+
+#_option_value
+
+#_____________________________________________________________________________
+def make_config(cf, nthreads=None):
+
+    #configuration for sim_setup from the card cf, nthreads overrides
+    #the number of threads in the card (0 for all cores)
+
+    c = sim_config()
+
+    for i in ["cross_angle", "y_angle", "Ee", "Ep"]:
+        setattr(c, i, cf.flt(i))
+
+    #bunch parameters, electrons and protons/nuclei
+    for b in ["e_", "p_"]:
+        setattr(c, b+"np", cf.int(b+"np"))
+        for i in ["rmsx", "rmsy", "bsx", "bsy", "rmsz"]:
+            setattr(c, b+i, cf.flt(b+i))
+
+    #nucleus mass number and charge
+    c.A = cf.int("A") if cf.has_option("A") else 1
+    c.Z = cf.int("Z") if cf.has_option("Z") else 1
+
+    #random seed and number of threads (0 for all cores)
+    c.seed = cf.int("seed") if cf.has_option("seed") else 1
+    if cf.has_option("sampler"):
+        c.sampler = _option_value(cf, "sampler", samplers)
+    if nthreads is None:
+        nthreads = cf.int("nthreads") if cf.has_option("nthreads") else 0
+    c.nthreads = nthreads
+
+    #shifted binning and single precision for bunch densities
+    c.nsub = cf.int("nsub") if cf.has_option("nsub") else 0
+    c.single = cf.int("single") if cf.has_option("single") else 0
+
+    #transverse slopes of particles for the hourglass
+    c.hourglass = cf.int("hourglass") if cf.has_option("hourglass") else 0
+
+    #overlap kernel and bunch intensities for the luminosity
+    if cf.has_option("kernel"):
+        c.kernel = _option_value(cf, "kernel", kernels)
+    for i in ["e_int", "p_int"]:
+        if cf.has_option(i):
+            setattr(c, i, cf.flt(i))
+
+    #bunch trains, bunches in each train, spacing in ns and relative spread in intensity
+    c.nbunch = cf.int("nbunch") if cf.has_option("nbunch") else 1
+    for i in ["spacing", "int_spread"]:
+        if cf.has_option(i):
+            setattr(c, i, cf.flt(i))
+
+    #bins, ranges around the overlap from a coarse pilot with adaptive,
+    #ranges from the card are then not needed
+    c.adaptive = cf.int("adaptive") if cf.has_option("adaptive") else 0
+    for ax in ["x", "y", "z"]:
+        setattr(c, "n"+ax, cf.int("n"+ax))
+        if c.adaptive > 0 and not cf.has_option(ax+"min"): continue
+        setattr(c, ax+"min", cf.flt(ax+"min"))
+        setattr(c, ax+"max", cf.flt(ax+"max"))
+
+    #bunch particles from the cache if configured, size limit in MB
+    if cf.has_option("cache_dir"):
+        c.cache_dir = cf.str("cache_dir").encode()
+        c.cache_size = cf.flt("cache_size") if cf.has_option("cache_size") else 1000.
+
+    #periodic checkpoint for the evolution
+    if cf.has_option("checkpoint"):
+        c.checkpoint = cf.str("checkpoint").encode()
+        c.checkpoint_every = cf.int("checkpoint_every") if cf.has_option("checkpoint_every") else 50
+
+    return c
+
+#make_config
+
+#_____________________________________________________________________________
+def make_sim(lib, cf, nthreads=None):
+
+    #simulation with the electron and proton/nucleus bunches from the config cf,
+    #nthreads overrides the number of threads in the config (0 for all cores)
+
+    lib.sim_setup.restype = c_void_p
+    lib.sim_setup.argtypes = [POINTER(sim_config)]
+
+    return c_void_p( lib.sim_setup(byref(make_config(cf, nthreads))) )
+
+#make_sim
+
+#_____________________________________________________________________________
+def run_schedule(lib, sim, times, xy=True, z=True):
+
+    #bunches moved to each of the times (ns) in one call, returns the pairs in xy
+    #as NumPy array (ntimes, nx+2, ny+2) and in z as (ntimes, nz+2), including
+    #underflow and overflow bins, None for output not requested
+
+    import numpy as np
+
+    lib.sim_run_schedule.restype = None
+    lib.sim_run_schedule.argtypes = [c_void_p, POINTER(c_double), c_int, POINTER(c_double), POINTER(c_double)]
+
+    nbin = (c_int*3)()
+    lib.sim_get_nbins(sim, nbin)
+    nx, ny, nz = nbin
+
+    times = np.ascontiguousarray(times, dtype=np.float64)
+    nt = len(times)
+
+    out_xy = np.zeros((nt, nx+2, ny+2)) if xy else None
+    out_z = np.zeros((nt, nz+2)) if z else None
+
+    ptr = lambda a: a.ctypes.data_as(POINTER(c_double)) if a is not None else None
+
+    lib.sim_run_schedule(sim, ptr(times), nt, ptr(out_xy), ptr(out_z))
+
+    return out_xy, out_z
+
+#run_schedule
+
+#_____________________________________________________________________________
+def delete_sim(lib, sim):
+
+    #delete the simulation made by make_sim together with its bunches
+
+    lib.sim_get_bunch.restype = c_void_p
+
+    for i in range(lib.sim_get_nbunch(sim)):
+        lib.bunch_delete( c_void_p(lib.sim_get_bunch(sim, i)) )
+
+    lib.sim_delete(sim)
+
+    _progress.pop(sim.value, None)
+
+#delete_sim
+
+#_____________________________________________________________________________
+def sim_stats(lib, sim):
+
+    #sum, mean and RMS of the time integrals along x, y and z
+
+    stat = []
+    for ia in range(3):
+        st = (c_double*3)()
+        lib.sim_get_stats(sim, ia, st)
+        stat.append( tuple(st) )
+
+    return stat
+
+#sim_stats
+
+#_____________________________________________________________________________
+def sim_integral(lib, sim, ia):
+
+    #time integral along axis ia (0, 1, 2 for x, y, z) including underflow
+    #and overflow bins, as a copy in NumPy array
+
+    lib.sim_get_integral.restype = c_int
+    lib.sim_get_integral.argtypes = [c_void_p, c_int, POINTER(POINTER(c_double))]
+
+    import numpy as np
+
+    val = POINTER(c_double)()
+    n = lib.sim_get_integral(sim, ia, byref(val))
+
+    return np.ctypeslib.as_array(val, shape=(n,)).copy()
+
+#sim_integral
+
+#_____________________________________________________________________________
+def sim_ranges(lib, sim):
+
+    #bin ranges (min, max) along x, y and z
+
+    lo = (c_double*3)()
+    hi = (c_double*3)()
+    lib.sim_get_ranges(sim, lo, hi)
+
+    return [(lo[i], hi[i]) for i in range(3)]
+
+#sim_ranges
+
+#_____________________________________________________________________________
+def get_metrics(lib, sim):
+
+    #timers and counters of the simulation as dictionary
+
+    m = sim_metrics()
+    lib.sim_get_metrics(sim, byref(m))
+
+    return {i[0]: getattr(m, i[0]) for i in m._fields_}
+
+#get_metrics
+
+#_____________________________________________________________________________
+def set_progress(lib, sim, func):
+
+    #call func(istep, nstep, time) at each step of the evolution, None to remove
+
+    cb = progress_func(func) if func is not None else progress_func()
+    _progress[sim.value] = cb
+
+    lib.sim_set_progress(sim, cb)
+
+#set_progress
+
+#_____________________________________________________________________________
+def evolve_fit(lib, cf, sim=None, tmin=-0.6, tmax=0.6, nstep=200, auto=False, frac=0.5, gaus=False,
+        nthreads=None, out=None, fit=True):
+
+    #evolution for the config cf in this process, with the results in memory:
+    #bin edges "edges_x", "edges_y", "edges_z", time integrals "hxt", "hyt", "hzt"
+    #including underflow and overflow, "stat" as from sim_stats, "metrics",
+    #"total" overlap for gaus, and with fit the Gaussian fits "fit_x", "fit_y",
+    #"fit_z" as from gaus_fit.fit_integral, or with "error" if the fit fails;
+    #auto for the time window from the bunches, gaus for analytic Gaussian overlap;
+    #ROOT output to out if set; a simulation made here is deleted at the end,
+    #sim given by the caller is kept
+
+    import numpy as np
+
+    own = sim is None
+    if own:
+        sim = make_sim(lib, cf, nthreads)
+
+    lib.sim_set_out(sim, out.encode() if out is not None else b"")
+
+    res = {}
+
+    if gaus:
+        lib.sim_run_gaus.restype = c_double
+        res["total"] = lib.sim_run_gaus(sim, c_double(tmin), c_double(tmax))
+    elif auto:
+        lib.sim_run_auto(sim, nstep, c_double(frac))
+    else:
+        lib.sim_run_evolution(sim, c_double(tmin), c_double(tmax), nstep)
+
+    #bin ranges from the simulation, set by the pilot with adaptive binning
+    ranges = sim_ranges(lib, sim)
+
+    for ia, ax in enumerate(["x", "y", "z"]):
+        res["edges_"+ax] = np.linspace(ranges[ia][0], ranges[ia][1], cf.int("n"+ax)+1)
+        res["h"+ax+"t"] = sim_integral(lib, sim, ia)
+
+    res["stat"] = np.array(sim_stats(lib, sim))
+    res["metrics"] = get_metrics(lib, sim)
+
+    if own:
+        delete_sim(lib, sim)
+
+    if fit:
+        from gaus_fit import fit_integral
+
+        #start for the fit in z as in macro/fit_xyz.py
+        for ax, p0 in [("x", None), ("y", None), ("z", [0, 10])]:
+            edges = res["edges_"+ax]
+            try:
+                res["fit_"+ax] = fit_integral(res["h"+ax+"t"], edges[0], edges[-1], p0)
+            except Exception as e:
+                res["fit_"+ax] = {"error": str(e)}
+
+    return res
+
+#evolve_fit
+
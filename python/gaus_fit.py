@@ -0,0 +1,52 @@
+
+#Gaussian fit to the time integrals in pairs
+
+import numpy as np
+from scipy.stats import norm
+from scipy.optimize import curve_fit
+
+#_____________________________________________________________________________
+def arr_to_np(val, xmin, xmax):
+
+    #bin edges and content normalized to density from array with underflow
+    #and overflow, the bins are selected as in h1_to_np in macro/fit_xyz.py,
+    #from underflow to the last but one bin
+
+    nbins = len(val)-2
+    width = (xmax-xmin)/nbins
+
+    edges = xmin + (np.arange(nbins+1)-1)*width
+    content = np.array(val[:nbins], dtype=float)
+
+    content /= content.sum()*width
+
+    return edges, content
+
+#arr_to_np
+
+#_____________________________________________________________________________
+def fit_gaus(edges, content, p0=None):
+
+    #mean and width from fit at bin centers, with the covariance matrix
+
+    centers = (0.5*( edges[1:] + edges[:-1]) )
+    pars, cov = curve_fit(lambda x, mu, sig : norm.pdf(x, loc=mu, scale=sig), centers, content, p0=p0)
+
+    return pars, cov
+
+#fit_gaus
+
+#_____________________________________________________________________________
+def fit_integral(val, xmin, xmax, p0=None):
+
+    #Gaussian fit to a time integral with underflow and overflow, mean and width
+    #with their uncertainties and the sum of the fitted bins, as dictionary
+
+    edges, content = arr_to_np(val, xmin, xmax)
+    pars, cov = fit_gaus(edges, content, p0)
+
+    return {"mu": float(pars[0]), "mu_err": float(np.sqrt(cov[0,0])), "sigma": float(pars[1]),
+        "sigma_err": float(np.sqrt(cov[1,1])), "sum": float(np.sum(val[:len(val)-2]))}
+
+#fit_integral
+
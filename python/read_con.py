@@ -32,4 +32,8 @@ class read_con:
 
         return self.con.has_option("main", par)
 
+    #_____________________________________________________________________________
+    def str(self, par):
+
+        return self.con.get("main", par)
 
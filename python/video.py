@@ -0,0 +1,129 @@
+
+#video frames rendered in parallel worker processes and piped to ffmpeg
+
+import multiprocessing
+import os
+import subprocess
+from ctypes import c_double
+
+import numpy as np
+
+from beam_lib import run_schedule
+
+#state in the worker processes, the simulation is a copy made at the fork
+_worker = {}
+
+#_____________________________________________________________________________
+def render_video(lib, sim, out, times, draw, width, height, nproc=0, fps=30):
+
+    #frames at the given times, drawn by draw(can, i, time) on a canvas width x height
+    #in the worker processes and written in order to the stdin of one ffmpeg encoder,
+    #draw returns the objects to keep until the frame is taken;
+    #the workers are forked with copies of the simulation at its present state,
+    #which is taken as time zero, so the next frames are made while the encoder
+    #takes the finished ones; the cores are shared among the workers for their threads
+
+    if nproc < 1:
+        nproc = os.cpu_count()
+    nproc = max(1, min(nproc, len(times)))
+
+    nthr = max(1, os.cpu_count() // nproc)
+
+    ctx = multiprocessing.get_context("fork")
+    enc = None
+
+    with ctx.Pool(nproc, initializer=_init_worker, initargs=(lib, sim, draw, width, height, nthr)) as pool:
+
+        for w, h, frame in pool.imap(_render_frame, enumerate(times)):
+
+            #encoder started with the size of the first frame
+            if enc is None:
+                enc = _start_encoder(out, w, h, fps)
+
+            enc.stdin.write(frame)
+
+    if enc is not None:
+        enc.stdin.close()
+        enc.wait()
+
+#render_video
+
+#_____________________________________________________________________________
+def _start_encoder(out, width, height, fps):
+
+    #ffmpeg reading raw BGRA frames from stdin
+
+    cmd = ["ffmpeg", "-y", "-loglevel", "error"]
+    cmd += ["-f", "rawvideo", "-pix_fmt", "bgra", "-s", str(width)+"x"+str(height), "-r", str(fps), "-i", "-"]
+    cmd += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", "-r", str(fps), out]
+
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+#_start_encoder
+
+#_____________________________________________________________________________
+def _init_worker(lib, sim, draw, width, height, nthr):
+
+    from ROOT import gROOT, TCanvas, TImage
+
+    gROOT.SetBatch()
+
+    #threads in the simulation copy of this worker
+    lib.sim_set_nthreads(sim, nthr)
+
+    _worker["lib"] = lib
+    _worker["sim"] = sim
+    _worker["draw"] = draw
+    _worker["can"] = TCanvas("c1", "c1", width, height)
+    _worker["img"] = TImage.Create()
+
+    #time zero for the frames, present time of the simulation
+    lib.sim_get_time.restype = c_double
+    _worker["t0"] = lib.sim_get_time(sim)
+
+#_init_worker
+
+#_____________________________________________________________________________
+def _render_frame(item):
+
+    #move the simulation copy to the frame time, draw and return the pixels
+
+    i, time = item
+
+    lib = _worker["lib"]
+    sim = _worker["sim"]
+    can = _worker["can"]
+
+    run_schedule(lib, sim, [_worker["t0"] + time], False, False)
+
+    can.Clear()
+    keep = _worker["draw"](can, i, time)
+    can.Update()
+
+    frame = _grab(can, _worker["img"])
+
+    del keep
+
+    return frame
+
+#_render_frame
+
+#_____________________________________________________________________________
+def _grab(can, img):
+
+    #canvas pixels as ARGB words, BGRA bytes in memory
+
+    img.FromPad(can)
+
+    w = img.GetWidth()
+    h = img.GetHeight()
+
+    argb = img.GetArgbArray()
+    argb.reshape((w*h,))
+
+    frame = np.frombuffer(argb, dtype=np.uint32, count=w*h).tobytes()
+
+    return w, h, frame
+
+#_grab
+
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+#precision of the fitted widths for bunch particles from pseudo-random numbers
+#and from scrambled Sobol points at equal particle counts, as the spread of the
+#Gaussian fits over independent seeds, report as table and in JSON
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append("./python")
+from batch import add_evolution_args, run_tasks
+from read_con import read_con
+
+#_____________________________________________________________________________
+def main():
+
+    parser = argparse.ArgumentParser(description="Fitted widths from pseudo-random and Sobol bunch particles")
+    parser.add_argument("card", help="configuration file")
+    parser.add_argument("--np-scale", default="0.25,1", help="comma separated factors for the particle counts in the card")
+    parser.add_argument("--nseed", type=int, default=8, help="seeds for each sampler and particle count")
+    parser.add_argument("-p", "--nproc", type=int, default=0, help="worker processes, 0 for one per core")
+    parser.add_argument("-j", "--nthreads", type=int, default=1, help="threads in each worker, 0 for all cores")
+    parser.add_argument("-o", "--outdir", default="qmc", help="directory for the outputs")
+    add_evolution_args(parser)
+    args = parser.parse_args()
+
+    #fits are needed, the outputs of the single runs are not
+    args.fit = True
+    args.no_output = True
+
+    cf = read_con(args.card)
+    nam = os.path.splitext(os.path.basename(args.card))[0]
+
+    samplers = ["random", "sobol"]
+    scales = [float(i) for i in args.np_scale.split(",")]
+
+    #all samplers, particle counts and seeds in one batch
+    tasks = []
+    for scale in scales:
+        e_np = int(cf.int("e_np")*scale)
+        p_np = int(cf.int("p_np")*scale)
+        for smp in samplers:
+            for seed in range(1, args.nseed+1):
+                over = {"sampler": smp, "seed": seed, "e_np": e_np, "p_np": p_np}
+                tasks.append( (args.card, "{0}_{1}_x{2:g}_s{3}".format(nam, smp, scale, seed), over, args) )
+
+    res = run_tasks(tasks, args)
+
+    #fitted widths for each sampler and particle count
+    rows = []
+    for it in range(0, len(tasks), args.nseed):
+
+        over = tasks[it][2]
+        row = {"sampler": over["sampler"], "e_np": over["e_np"], "p_np": over["p_np"], "nfit": {}}
+
+        for ax in ["x", "y", "z"]:
+            fits = [i["fit"][ax] for i in res[it:it+args.nseed] if "fit" in i and "sigma" in i["fit"].get(ax, {})]
+            sig = np.array([f["sigma"] for f in fits])
+            err = np.array([f["sigma_err"] for f in fits])
+
+            row["nfit"][ax] = len(fits)
+            row["sigma_"+ax] = float(np.mean(sig)) if len(sig) > 0 else None
+            row["spread_"+ax] = float(np.std(sig, ddof=1)) if len(sig) > 1 else None
+            row["fit_err_"+ax] = float(np.mean(err)) if len(err) > 0 else None
+
+        rows.append(row)
+
+    report(rows, os.path.join(args.outdir, "qmc_report.txt"))
+
+    with open(os.path.join(args.outdir, "qmc_report.json"), "w") as f:
+        json.dump({"card": args.card, "nseed": args.nseed, "rows": rows}, f, indent=2)
+
+#main
+
+#_____________________________________________________________________________
+def report(rows, out):
+
+    #table of the widths and their spread over the seeds, and the ratio of the
+    #spreads at the same particle counts, its square is the factor in particles
+    #for the same precision with pseudo-random numbers
+
+    #x and z in mm, y in um
+    units = {"x": 1., "y": 1e3, "z": 1.}
+
+    head = "{0:<8} {1:>8} {2:>8}".format("sampler", "e_np", "p_np")
+    for ax in ["x", "y", "z"]:
+        u = "um" if ax == "y" else "mm"
+        head += " {0:>12} {1:>12} {2:>12}".format("sig_"+ax+" ("+u+")", "spread", "fit err")
+
+    lines = [head, "-"*len(head)]
+
+    def fmt(v, u):
+        return "{0:>12}".format("-") if v is None else "{0:>12.5g}".format(v*u)
+
+    for r in rows:
+        line = "{0:<8} {1:>8} {2:>8}".format(r["sampler"], r["e_np"], r["p_np"])
+        for ax in ["x", "y", "z"]:
+            line += " "+" ".join(fmt(r[k+"_"+ax], units[ax]) for k in ["sigma", "spread", "fit_err"])
+        lines.append(line)
+
+    #ratio of spreads, pseudo-random over Sobol, at the same particle counts
+    lines += ["", "spread random / spread sobol"]
+    for r in rows:
+        if r["sampler"] != "random": continue
+        for q in rows:
+            if q["sampler"] != "sobol" or q["e_np"] != r["e_np"] or q["p_np"] != r["p_np"]: continue
+
+            rat = []
+            for ax in ["x", "y", "z"]:
+                a, b = r["spread_"+ax], q["spread_"+ax]
+                rat.append( "{0}: {1:.2f}".format(ax, a/b) if a is not None and b else ax+": -" )
+
+            lines.append( "{0:>8} {1:>8}  ".format(r["e_np"], r["p_np"]) + ", ".join(rat) )
+
+    table = "\n".join(lines)
+
+    print(table)
+
+    with open(out, "w") as f:
+        f.write(table+"\n")
+
+#report
+
+#_____________________________________________________________________________
+if __name__ == "__main__":
+
+    main()
+
@@ -1,101 +1,349 @@
 #!/usr/bin/python3
 
-#import ctypes
-from ctypes import CDLL, c_double, c_void_p
+#bunch overlap simulation, the work is selected by a subcommand:
+#
+#  evolve    time integrals of the overlap, compute-only unless --draw
+#  snapshot  bunches and pairs at one time, to 01fig.png or 01fig.pdf
+#  video     movie of the bunch crossing, to movie.mp4
+#  scan      evolution for values of one card option in worker processes
+#  converge  replicas and bunch size until the fits reach the tolerances
+#
+#ROOT graphics are imported only for the drawing
+
+import argparse
+from ctypes import CDLL, c_double
+import json
 import os
 import sys
 
-import ROOT as rt
-from ROOT import gPad, gROOT, gStyle, gSystem, TCanvas
-from ROOT import TDatabasePDG, TVector3, TH1D, TMath
-
 sys.path.append("./python")
-from beam_lin import beam_lin
-import plot_utils as ut
+from beam_lib import evolve_fit, get_metrics, make_sim, set_progress
 from read_con import read_con
 
 #_____________________________________________________________________________
 def main():
 
-    #name of config file from command line argument
-    args = sys.argv
-    if len(args) < 2:
-        print("No configuration specified.")
-        quit()
-    args.pop(0)
-    #config = args.pop(0)
+    parser = argparse.ArgumentParser(description="Bunch overlap at the EIC")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    #options for all commands which make the simulation
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("card", help="configuration file")
+    common.add_argument("-j", "--nthreads", type=int, default=None, help="threads, 0 for all cores, from card if not set")
+    common.add_argument("-m", "--metrics", default=None, help="timers and counters to JSON file")
+    common.add_argument("-v", "--verbose", action="store_true", help="progress at each step")
+
+    p = sub.add_parser("evolve", parents=[common], help="time integrals of the overlap")
+    p.add_argument("-o", "--out", default="sim.root", help="output, NumPy arrays for .npz, ROOT histograms otherwise")
+    p.add_argument("--tmin", type=float, default=-0.6, help="start of the evolution (ns)")
+    p.add_argument("--tmax", type=float, default=0.6, help="end of the evolution (ns)")
+    p.add_argument("--nstep", type=int, default=200, help="number of steps")
+    p.add_argument("--auto", action="store_true", help="time window from the bunches, tmin and tmax are not used")
+    p.add_argument("--frac", type=float, default=0.5, help="fraction of uniform steps with --auto")
+    p.add_argument("--gaus", action="store_true", help="analytic Gaussian overlap in place of the particles")
+    p.add_argument("--fit", action="store_true", help="Gaussian fits to the time integrals")
+    p.add_argument("--draw", action="store_true", help="draw the time integrals to 01fig.pdf")
+    p.set_defaults(func=evolve)
+
+    p = sub.add_parser("snapshot", parents=[common], help="bunches and pairs at one time")
+    p.add_argument("--what", choices=["beams", "xy", "pairs_xyz", "pairs"], default="pairs", help="plot to make")
+    p.set_defaults(func=snapshot)
+
+    p = sub.add_parser("video", parents=[common], help="movie of the bunch crossing")
+    p.add_argument("--what", choices=["beams", "pairs"], default="pairs", help="beams only or with pairs")
+    p.add_argument("-p", "--nproc", type=int, default=0, help="worker processes, 0 for one per core")
+    p.set_defaults(func=video)
+
+    p = sub.add_parser("scan", help="evolution for values of one card option")
+    p.add_argument("card", help="configuration file")
+    p.add_argument("--par", required=True, help="card option to scan, e.g. y_angle")
+    p.add_argument("--values", required=True, help="comma separated values")
+    p.add_argument("-p", "--nproc", type=int, default=0, help="worker processes, 0 for one per core")
+    p.add_argument("-j", "--nthreads", type=int, default=1, help="threads in each worker, 0 for all cores")
+    p.add_argument("-o", "--outdir", default="scan", help="directory for the outputs")
+    p.set_defaults(func=scan)
+
+    #evolution options shared with the batch runner
+    from batch import add_evolution_args
+    add_evolution_args(p)
+
+    p = sub.add_parser("converge", help="replicas and bunch size until the fits reach the tolerances")
+    p.add_argument("card", help="configuration file")
+    p.add_argument("--rtol", type=float, default=0.01, help="tolerance on standard errors of mu and sigma relative to sigma")
+    p.add_argument("--tol", default=None, help="comma separated absolute tolerances along x, y and z (mm), in place of rtol")
+    p.add_argument("--np-start", type=float, default=0.25, help="factor for the particle counts in the card to start with")
+    p.add_argument("--np-max", type=float, default=16, help="largest factor for the particle counts")
+    p.add_argument("--min-rep", type=int, default=4, help="replicas before the first test")
+    p.add_argument("--max-rep", type=int, default=32, help="largest number of replicas, the bunches grow beyond")
+    p.add_argument("-p", "--nproc", type=int, default=0, help="worker processes, 0 for one per core")
+    p.add_argument("-j", "--nthreads", type=int, default=1, help="threads in each worker, 0 for all cores")
+    p.add_argument("-o", "--outdir", default="converge", help="directory for the outputs")
+    p.set_defaults(func=converge)
+    add_evolution_args(p)
+
+    args = parser.parse_args()
+
+    args.func(args)
+
+#main
+
+#_____________________________________________________________________________
+def setup(args):
 
-    cf = read_con(args.pop(0))
+    #library and simulation for the card
+
+    cf = read_con(args.card)
 
     lib = CDLL("build/libeic_beam_shape.so")
 
-    cross_angle = cf.flt("cross_angle") # mrad
-    y_angle = cf.flt("y_angle") # urad
-
-    #simulation instance
-    lib.make_sim.restype = c_void_p
-    lib.make_bunch.restype = c_void_p
-
-    sim = c_void_p( lib.make_sim() )
-
-    #electron bunch
-    b1 = c_void_p( lib.make_bunch(cf.int("e_np"), cf("e_rmsx"), cf("e_bsx"), cf("e_rmsy"), cf("e_bsy"), cf("e_rmsz")) )
-    lib.bunch_rotate_y(b1, c_double(-cross_angle/2.))
-
-    me = TDatabasePDG.Instance().GetParticle(11).Mass()
-    b1_p = TMath.Sqrt(cf.flt("Ee")**2 - me**2)
-    b1_dir = TVector3(0, 0, -1)
-    lib.bunch_set_kinematics(b1, cf("Ee"), c_double(b1_p), c_double(b1_dir.x()), c_double(b1_dir.y()), c_double(b1_dir.z()))
-
-    #proton/nucleus bunch
-    b2 = c_void_p( lib.make_bunch(cf.int("p_np"), cf("p_rmsx"), cf("p_bsx"), cf("p_rmsy"), cf("p_bsy"), cf("p_rmsz")) )
-    lib.bunch_set_color(b2, rt.kRed)
-    #lib.bunch_rotate_y(b2, c_double(-cross_angle))
-    lib.bunch_rotate_y(b2, c_double(-cross_angle/2.))
-
-    #bunch kinematics for proton/nucleus
-    nA = 1
-    nZ = 1
-    if cf.has_option("A"):
-        nA = cf.int("A")
-    if cf.has_option("Z"):
-        nZ = cf.int("Z")
-    mp = TDatabasePDG.Instance().GetParticle(2212).Mass()
-    nmass = mp*nA
-    b2_p = TMath.Sqrt( cf.flt("Ep")**2 - mp**2 )*nZ
-    b2_en = TMath.Sqrt( b2_p**2 + nmass**2 )
-    #print("en: ", b2_en/nA)
-
-    #direction for proton/nucleus bunch
-    b2_dir = TVector3(0, 0, 1)
-    b2_dir.RotateY(-cross_angle*1e-3)
-    #b2_dir = TVector3(TMath.Sin(cross_angle*1e-3), 0, TMath.Cos(cross_angle*1e-3))
-    #print(b2_dir.x(), b2_dir.y(), b2_dir.z())
-    #print(TMath.Sin(cross_angle*1e-3), TMath.Cos(cross_angle*1e-3))
-    b2_dir.RotateX(y_angle*1e-6)
-    lib.bunch_set_kinematics(b2, c_double(b2_en), c_double(b2_p), c_double(b2_dir.x()), c_double(b2_dir.y()), c_double(b2_dir.z()))
-
-    #put bunches to the simulation
-    lib.sim_add_bunch(sim, b2)
-    lib.sim_add_bunch(sim, b1)
-
-    lib.sim_set_bins(sim, cf.int("nx"), cf("xmin"), cf("xmax"), cf.int("ny"), cf("ymin"), cf("ymax"), cf.int("nz"), cf("zmin"), cf("zmax"))
-
-    #select the function
-    iplot = 6
-
-    func = []
-    func.append( make_plot ) # 0
-    func.append( make_video ) # 1
-    func.append( project_xy ) # 2
-    func.append( pairs_xyz ) # 3
-    func.append( evolution ) # 4
-    func.append( make_plot_pairs ) # 5
-    func.append( video_pairs ) # 6
-
-    func[iplot](lib, sim, cross_angle)
+    sim = make_sim(lib, cf, args.nthreads)
 
-#main
+    if args.verbose:
+        set_progress(lib, sim, lambda istep, nstep, time: print(istep, "/", nstep, "t =", "{0:.4f}".format(time), "ns"))
+
+    return lib, sim, cf
+
+#setup
+
+#_____________________________________________________________________________
+def write_metrics(lib, sim, args):
+
+    #timers and counters for the run
+
+    if args.metrics is None: return
+
+    with open(args.metrics, "w") as f:
+        json.dump(get_metrics(lib, sim), f, indent=2)
+
+#write_metrics
+
+#_____________________________________________________________________________
+def evolve(args):
+
+    #time integrals of the overlap to ROOT or NumPy output
+
+    lib, sim, cf = setup(args)
+
+    npz = args.out.endswith(".npz")
+
+    #ROOT histograms written by the library, NumPy arrays from the results here
+    res = evolve_fit(lib, cf, sim, args.tmin, args.tmax, args.nstep, args.auto, args.frac, args.gaus,
+        out=None if npz else args.out, fit=args.fit)
+
+    if args.gaus:
+        print("Total overlap (mm^-2):", res["total"])
+
+    #memory allocated for the simulation
+    m = res["metrics"]
+    print("Memory (MB): particles {0:.1f}, densities {1:.1f}, pairs {2:.1f}".format(
+        m["mem_part"]/1e6, m["mem_dens"]/1e6, m["mem_pairs"]/1e6))
+
+    if args.fit:
+        for ax in ["x", "y", "z"]:
+            f = res["fit_"+ax]
+            if "error" in f:
+                print(ax+": fit failed,", f["error"])
+                continue
+            print("{0}: mu = {1:.6g} +/- {2:.2g} mm, sigma = {3:.6g} +/- {4:.2g} mm".format(ax, f["mu"], f["mu_err"], f["sigma"], f["sigma_err"]))
+
+    if npz:
+        import numpy as np
+
+        np.savez(args.out, **{k: res[k] for k in res if k.startswith("edges_") or k.startswith("h") or k == "stat"})
+
+    write_metrics(lib, sim, args)
+
+    if args.draw:
+        init_root()
+        draw_evolution(lib, sim)
+
+#evolve
+
+#_____________________________________________________________________________
+def snapshot(args):
+
+    lib, sim, cf = setup(args)
+
+    init_root()
+
+    func = {"beams": make_plot, "xy": project_xy, "pairs_xyz": pairs_xyz, "pairs": make_plot_pairs}
+
+    func[args.what](lib, sim, cf.flt("cross_angle"))
+
+    write_metrics(lib, sim, args)
+
+#snapshot
+
+#_____________________________________________________________________________
+def video(args):
+
+    lib, sim, cf = setup(args)
+
+    init_root()
+
+    func = {"beams": make_video, "pairs": video_pairs}
+
+    func[args.what](lib, sim, cf.flt("cross_angle"), args.nproc)
+
+    write_metrics(lib, sim, args)
+
+#video
+
+#_____________________________________________________________________________
+def scan(args):
+
+    #evolution for each value of the option, outputs named by the value
+
+    from batch import run_tasks
+
+    nam = os.path.splitext(os.path.basename(args.card))[0]
+
+    tasks = []
+    for val in args.values.split(","):
+        tasks.append( (args.card, nam+"_"+args.par+"_"+val, {args.par: val}, args) )
+
+    run_tasks(tasks, args)
+
+#scan
+
+#_____________________________________________________________________________
+def converge(args):
+
+    #replicas with independent seeds, each a full evolution with the Gaussian fits,
+    #until the standard errors of the mean mu and sigma along x, y and z are within
+    #the tolerances; more replicas are added while their expected number is within
+    #max-rep, else the bunches grow by 4 and the replicas start again
+
+    import math
+    import time
+    from multiprocessing import Pool
+    import numpy as np
+    from batch import run_card
+
+    #fits are needed, the outputs of the single runs are not
+    args.fit = True
+    args.no_output = True
+
+    os.makedirs(args.outdir, exist_ok=True)
+
+    cf = read_con(args.card)
+    nam = os.path.splitext(os.path.basename(args.card))[0]
+    seed = cf.int("seed") if cf.has_option("seed") else 1
+
+    #bunches in each train for the particle budget
+    nbunch = max(1, cf.int("nbunch")) if cf.has_option("nbunch") else 1
+
+    tol = [float(i) for i in args.tol.split(",")] if args.tol is not None else None
+
+    #pairs as minimum of the counts make the widths depend on the counts themselves,
+    #beyond the errors from the replicas
+    if not cf.has_option("kernel") or cf.str("kernel") == "min":
+        print("Kernel min: fitted widths change with the particle counts, kernel = product has no such bias")
+
+    nproc = args.nproc if args.nproc > 0 else os.cpu_count()
+
+    axes = ["x", "y", "z"]
+    scale = args.np_start
+    budget = 0
+    nrun = 0
+    start = time.time()
+
+    with Pool(nproc) as pool:
+
+        while True:
+
+            e_np = int(cf.int("e_np")*scale)
+            p_np = int(cf.int("p_np")*scale)
+
+            fits = []
+            nrep = args.min_rep
+            while True:
+
+                #next replicas, seed of each replica from the card seed and the run count
+                nfit = len(fits)
+                tasks = []
+                for i in range(nrep - len(fits)):
+                    over = {"seed": seed+nrun, "e_np": e_np, "p_np": p_np}
+                    tasks.append( (args.card, "{0}_x{1:g}_s{2}".format(nam, scale, seed+nrun), over, args) )
+                    nrun += 1
+
+                for i in pool.map(run_card, tasks, chunksize=1):
+                    budget += (e_np + p_np)*nbunch
+                    fit = i.get("fit", {})
+                    if "error" in i or any("sigma" not in fit.get(ax, {}) for ax in axes):
+                        print("Replica", i["card"], "failed:", i.get("error", "fit"))
+                        continue
+                    fits.append(fit)
+
+                if len(fits) < 2:
+                    raise RuntimeError("No replicas with fits for "+args.card)
+
+                #all new replicas failed, more of them would fail the same way
+                if len(fits) == nfit:
+                    raise RuntimeError("No new replicas with fits for "+args.card+", stopped at {0} replicas".format(nfit))
+
+                #means over the replicas and their standard errors
+                res = {}
+                need = 0.
+                for ia, ax in enumerate(axes):
+                    for par in ["mu", "sigma"]:
+                        v = np.array([f[ax][par] for f in fits])
+                        res[par+"_"+ax] = float(np.mean(v))
+                        res[par+"_"+ax+"_se"] = float(np.std(v, ddof=1)/math.sqrt(len(v)))
+                    t = tol[ia] if tol is not None else args.rtol*abs(res["sigma_"+ax])
+                    need = max(need, max(res["mu_"+ax+"_se"], res["sigma_"+ax+"_se"])/t)
+
+                print("np x{0:g} (e_np {1}, p_np {2}), replicas {3}, se/tol {4:.3g}, particles {5}, time {6:.1f} s".format(
+                    scale, e_np, p_np, len(fits), need, budget, time.time()-start))
+
+                #expected replicas for the tolerances, error falls as 1/sqrt(replicas)
+                nrep = int(math.ceil(len(fits)*need*need))
+                if need <= 1 or nrep > args.max_rep: break
+
+            if need <= 1 or scale*4 > args.np_max: break
+
+            #larger bunches, error for the same replicas falls by 2
+            scale *= 4
+
+    res.update({"card": args.card, "converged": need <= 1, "np_scale": scale, "e_np": e_np, "p_np": p_np,
+        "replicas": len(fits), "runs": nrun, "particles": budget, "time": time.time()-start})
+
+    if need <= 1:
+        print("Converged with {0} replicas of e_np {1}, p_np {2}, particles used {3}".format(len(fits), e_np, p_np, budget))
+    else:
+        print("Not converged, se/tol {0:.3g} with {1} replicas of e_np {2}, p_np {3}, particles used {4}".format(
+            need, len(fits), e_np, p_np, budget))
+
+    for ax in axes:
+        print("{0}: mu = {1:.6g} +/- {2:.2g} mm, sigma = {3:.6g} +/- {4:.2g} mm".format(ax,
+            res["mu_"+ax], res["mu_"+ax+"_se"], res["sigma_"+ax], res["sigma_"+ax+"_se"]))
+
+    with open(os.path.join(args.outdir, nam+"_converge.json"), "w") as f:
+        json.dump(res, f, indent=2)
+
+#converge
+
+#_____________________________________________________________________________
+def init_root():
+
+    #ROOT graphics for the drawing functions
+
+    global rt, gPad, TCanvas, TH1D, ut, beam_lin, render_video
+
+    import ROOT as rt
+    from ROOT import gPad, gROOT, gStyle, TCanvas, TH1D
+
+    import plot_utils as ut
+    from beam_lin import beam_lin
+    from video import render_video
+
+    gROOT.SetBatch()
+    gStyle.SetPadTickX(1)
+    gStyle.SetPadTickY(1)
+    gStyle.SetFrameLineWidth(2)
+    gStyle.SetPalette(1)
+
+#init_root
 
 #_____________________________________________________________________________
 def make_plot(lib, sim, cross_angle):
@@ -145,7 +393,7 @@ def make_plot(lib, sim, cross_angle):
 #make_plot
 
 #_____________________________________________________________________________
-def make_video(lib, sim, cross_angle):
+def make_video(lib, sim, cross_angle, nproc=0):
 
     #zmin = -40
     #zmax = 40
@@ -163,27 +411,13 @@ def make_video(lib, sim, cross_angle):
 
     out = "movie.mp4"
 
-    lib.sim_move(sim, c_double(t0-dt))
-    time = t0-dt
-
     #electron and proton beams
     beam_el = beam_lin(zmin, zmax)
     beam_p = beam_lin(zmin, zmax, -cross_angle)
     beam_p.col = rt.kRed
 
-    c1 = TCanvas("c1","c1",1200,900)
-
-    os.system("rm -f "+out)
-    os.system("rm -rf tmp")
-    os.system("mkdir tmp")
-
-    for i in range(nstep):
-
-        time += dt
-
-        lib.sim_move(sim, c_double(dt))
-
-        c1.Clear()
+    #frame at a given time, called in the worker processes
+    def draw(can, i, time):
 
         frame = gPad.DrawFrame(zmin, xmin, zmax, xmax) # xmin, ymin, xmax, ymax in ROOT
         ut.put_frame_yx_tit(frame, "#it{x} (mm)", "#it{z} (mm)", 1, 1.2)
@@ -200,12 +434,13 @@ def make_video(lib, sim, cross_angle):
         leg.AddEntry("", "#it{t} = "+"{0:.2f}".format(time)+" ns", "")
         leg.Draw("same")
 
-        nam = "tmp/fig_"+"{0:04d}".format(i)+".png"
-
         ut.invert_col(gPad)
-        c1.SaveAs(nam)
 
-    os.system("ffmpeg -r 30 -i tmp/fig_%04d.png -r 30 "+out)
+        return leg
+
+    times = [t0 + i*dt for i in range(nstep)]
+
+    render_video(lib, sim, out, times, draw, 1200, 900, nproc)
 
 #make_video
 
@@ -270,13 +505,9 @@ def pairs_xyz(lib, sim, cross_angle):
 #pairs_xyz
 
 #_____________________________________________________________________________
-def evolution(lib, sim, cross_angle):
+def draw_evolution(lib, sim):
 
-    tmin = -0.6
-    tmax = 0.6
-    nstep = 200
-
-    lib.sim_run_evolution(sim, c_double(tmin), c_double(tmax), nstep)
+    #time integrals in x, y and z from the evolution
 
     can = TCanvas("c1","c1",2400,800)
     can.Divide(3,1)
@@ -296,7 +527,7 @@ def evolution(lib, sim, cross_angle):
 
     can.SaveAs("01fig.pdf")
 
-#evolution
+#draw_evolution
 
 #_____________________________________________________________________________
 def make_plot_pairs(lib, sim, cross_angle):
@@ -315,7 +546,7 @@ def make_plot_pairs(lib, sim, cross_angle):
 #make_plot_pairs
 
 #_____________________________________________________________________________
-def create_plot_pairs(lib, sim, cross_angle, can, zpmax, time, outnam):
+def create_plot_pairs(lib, sim, cross_angle, can, zpmax, time, outnam=None):
 
     zmin = -370
     zmax = 370
@@ -397,12 +628,16 @@ def create_plot_pairs(lib, sim, cross_angle, can, zpmax, time, outnam):
 
     if invert: ut.invert_col(gPad)
 
-    can.SaveAs(outnam)
+    if outnam is not None:
+        can.SaveAs(outnam)
+
+    #legend objects to be kept while the canvas is in use
+    return leg, hle, hlp
 
 #create_plot_pairs
 
 #_____________________________________________________________________________
-def video_pairs(lib, sim, cross_angle):
+def video_pairs(lib, sim, cross_angle, nproc=0):
 
     tmin = -0.7
     tmax = 0.6
@@ -415,54 +650,20 @@ def video_pairs(lib, sim, cross_angle):
     zpmax = lib.sim_get_hzmax(sim)
 
     dt = float(tmax-tmin)/nstep
-    time = tmin-dt
-    lib.sim_move(sim, c_double(time))
 
-    can = TCanvas("c1","c1",950,950)
+    #frame at a given time, called in the worker processes
+    def draw(can, i, time):
 
-    os.system("rm -f "+out)
-    os.system("rm -rf tmp")
-    os.system("mkdir tmp")
+        return create_plot_pairs(lib, sim, cross_angle, can, zpmax, time)
 
-    for i in range(nstep):
+    times = [tmin + i*dt for i in range(nstep)]
 
-        lib.sim_move(sim, c_double(dt))
-
-        time += dt
-        can.Clear()
-
-        nam = "tmp/fig_"+"{0:04d}".format(i)+".png"
-        create_plot_pairs(lib, sim, cross_angle, can, zpmax, time, nam)
-
-    os.system("ffmpeg -r 30 -i tmp/fig_%04d.png "+out)
-    #os.system("ffmpeg -r 30 -i tmp/fig_%04d.png -q:v 2 "+out)
-    #os.system("rm -rf tmp")
+    render_video(lib, sim, out, times, draw, 950, 950, nproc)
 
 #video_pairs
 
 #_____________________________________________________________________________
 if __name__ == "__main__":
 
-    gROOT.SetBatch()
-    gStyle.SetPadTickX(1)
-    gStyle.SetPadTickY(1)
-    gStyle.SetFrameLineWidth(2)
-    gStyle.SetPalette(1)
-
     main()
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -11,47 +11,84 @@
 
 //ROOT
 #include "TVector3.h"
-#include "TF1.h"
+#include "TRandom3.h"
 #include "TGraph.h"
 #include "TLorentzVector.h"
 #include "TProfile2D.h"
 #include "TH1D.h"
+#include "TMath.h"
 
 //local classes
 #include "bunch.h"
+#include "par.h"
+#include "bunch_cache.h"
 
 using namespace std;
 
 //_____________________________________________________________________________
-bunch::bunch(int npart, double rmsx, double bsx, double rmsy, double bsy, double rmsz) {
+bunch::bunch(int npart, double rmsx, double bsx, double rmsy, double bsy, double rmsz, unsigned long seed, int nt,
+  const char *cache_dir, double cache_mb, int sampler): intensity(npart), nthr(nt) {
+
+  reset_metrics(true);
 
   //RMS emittance h/v, rmsx and rmsy in nm
   //beta* h/v, bsx and bsy in cm
   //RMS bunch length, rmsz in cm
+  //sampler 0 for pseudo-random particles, 1 for scrambled Sobol points
 
   //width in x, mm
-  double sx = sqrt( rmsx*1e-6*bsx*10 );
-  double smax = 4;
-  auto fx = TF1("fx", "gaus", -smax*sx, smax*sx);
-  fx.SetParameters(1, 0, sx);
+  sx = sqrt( rmsx*1e-6*bsx*10 );
 
   //width in y, mm
-  double sy = sqrt( rmsy*1e-6*bsy*10 );
-  auto fy = TF1("fy", "gaus", -smax*sy, smax*sy);
-  fy.SetParameters(1, 0, sy);
+  sy = sqrt( rmsy*1e-6*bsy*10 );
 
   //width in z, mm
-  double sz = rmsz*10;
-  auto fz = TF1("fz", "gaus", -smax*sz, smax*sz);
-  fz.SetParameters(1, 0, sz);
+  sz = rmsz*10;
+
+  //beta* in mm for the hourglass
+  betx = bsx*10;
+  bety = bsy*10;
+
+  gseed = seed;
+
+  //key with everything the particles depend on, for the cache and the checkpoints
+  char key[256];
+  snprintf(key, sizeof(key), "%s %d %.17g %.17g %.17g %.17g %.17g %lu %d", sampler == 1 ? "sobol1" : "gen1",
+    npart, rmsx, bsx, rmsy, bsy, rmsz, seed, gen_block);
+  genkey = key;
 
   //bunch particles
-  for(int i=0; i<npart; i++) {
+  px.resize(npart);
+  py.resize(npart);
+  pz.resize(npart);
+
+  metrics_timer tgen(met.t_gen);
+
+  //particles from the cache if given, generated and put to the cache otherwise
+  if( cache_dir ) {
+
+    bunch_cache cache(cache_dir, cache_mb);
+
+    if( !cache.read(key, npart, px.data(), py.data(), pz.data()) ) {
 
-    points.push_back(TVector3(fx.GetRandom(), fy.GetRandom(), fz.GetRandom()));
+      generate_all(seed, sampler);
+      cache.write(key, npart, px.data(), py.data(), pz.data());
+    }
+
+  } else {
+
+    generate_all(seed, sampler);
   }
 
-  gr.Set(npart);
+  //bunch centered at the origin, no rotation
+  tilt = 0;
+  cen.SetXYZ(0, 0, 0);
+  cen_pts = cen;
+
+  //binning filled from particles
+  nsub = 0;
+
+  //graph points are made only in draw
   gr.SetMarkerColor(kBlue);
   gr.SetMarkerStyle(kFullCircle);
   //gr.SetMarkerSize(0.2);
@@ -59,16 +96,228 @@ bunch::bunch(int npart, double rmsx, double bsx, double rmsy, double bsy, double
 
 }//bunch
 
+//_____________________________________________________________________________
+void bunch::generate_all(unsigned long seed, int sampler) {
+
+  //generation in blocks of particles, each block with its own random stream
+  //seeded from the bunch seed and block index, so the particles don't depend
+  //on how the blocks are shared among the threads; for the Sobol sampler the
+  //points are given by their index and the seed makes the scrambling
+
+  int npart = px.size();
+  int nblk = (npart+gen_block-1)/gen_block;
+
+  if( sampler == 1 ) {
+
+    //digital shift along each coordinate, from streams apart from the blocks
+    unsigned int shift[3];
+    for(int ia=0; ia<3; ia++) shift[ia] = block_seed(seed, -1-ia);
+
+    par_for(npart, nthr, [this, &shift](int, int i0, int i1) {
+      generate_sobol(i0, i1, shift);
+    });
+
+    return;
+  }
+
+  par_for(nblk, nthr, [this, npart, seed](int, int i0, int i1) {
+
+    for(int iblk=i0; iblk<i1; iblk++) {
+
+      generate(iblk*gen_block, min((iblk+1)*gen_block, npart), block_seed(seed, iblk));
+    }
+
+  });
+
+}//generate_all
+
+//_____________________________________________________________________________
+void bunch::generate(int i0, int i1, unsigned int rseed) {
+
+  //particles i0 <= i < i1 from independent random stream with seed rseed,
+  //Gaussian in x, y and z truncated at smax widths
+
+  TRandom3 rnd(rseed);
+
+  double smax = 4;
+
+  for(int i=i0; i<i1; i++) {
+
+    px[i] = gaus_trunc(rnd, sx, smax);
+    py[i] = gaus_trunc(rnd, sy, smax);
+    pz[i] = gaus_trunc(rnd, sz, smax);
+  }
+
+}//generate
+
+//_____________________________________________________________________________
+void bunch::generate_sobol(int i0, int i1, const unsigned int *shift) {
+
+  //particles i0 <= i < i1 from the points of the three-dimensional Sobol sequence,
+  //scrambled by digital shift and transformed to Gaussian truncated at smax widths
+
+  //direction numbers, first three dimensions of Joe and Kuo, 32 bits
+  static const vector<unsigned int> dir = []() {
+
+    vector<unsigned int> d(3*32);
+    unsigned int *d0 = &d[0], *d1 = &d[32], *d2 = &d[64];
+
+    for(int k=0; k<32; k++) {
+
+      //van der Corput for x
+      d0[k] = 1u << (31-k);
+
+      //s = 1, a = 0, m = {1} for y, s = 2, a = 1, m = {1, 3} for z
+      d1[k] = k < 1 ? 1u << 31 : d1[k-1] ^ (d1[k-1] >> 1);
+      d2[k] = k < 2 ? (k == 0 ? 1u : 3u) << (31-k) : d2[k-2] ^ (d2[k-2] >> 2) ^ d2[k-1];
+    }
+
+    return d;
+  }();
+
+  double smax = 4;
+  double sig[3] = {sx, sy, sz};
+  double *pos[3] = {px.data(), py.data(), pz.data()};
+
+  for(int i=i0; i<i1; i++) {
+    for(int ia=0; ia<3; ia++) {
+
+      unsigned int v = shift[ia];
+      for(unsigned int n=i, k=0; n > 0; n >>= 1, k++) {
+        if( n & 1 ) v ^= dir[32*ia + k];
+      }
+
+      //point at the center of its 2^-32 interval, never at 0 or 1
+      double u = (v + 0.5)/4294967296.;
+
+      pos[ia][i] = norm_trunc(u, sig[ia], smax);
+    }
+  }
+
+}//generate_sobol
+
+//_____________________________________________________________________________
+double bunch::norm_trunc(double u, double sig, double smax) {
+
+  //inverse of the Gaussian with width sig truncated at |x| < smax*sig, u in (0, 1)
+
+  double p0 = TMath::Freq(-smax);
+
+  return sig*TMath::NormQuantile( p0 + u*(1-2*p0) );
+
+}//norm_trunc
+
+//_____________________________________________________________________________
+void bunch::set_hourglass() {
+
+  //transverse slopes of particles for the hourglass effect, Gaussian with
+  //widths sig' = sqrt(eps/beta*) = sig/beta*; the positions are made at the waist,
+  //at the bunch center, so each particle is moved by its slopes times its distance
+  //from the waist along the direction of motion; to be called after rotate_y and
+  //set_kinematics, the slopes are in x and y of the lab frame
+
+  sync_points();
+
+  int npart = px.size();
+  int nblk = (npart+gen_block-1)/gen_block;
+
+  tx.resize(npart);
+  ty.resize(npart);
+
+  //random streams independent of the positions
+  par_for(nblk, nthr, [this, npart](int, int i0, int i1) {
+
+    for(int iblk=i0; iblk<i1; iblk++) {
+
+      generate_slopes(iblk*gen_block, min((iblk+1)*gen_block, npart), block_seed(~gseed, iblk));
+    }
+
+  });
+
+  //waist correction, distance past the waist along the direction of motion
+  for(int i=0; i<npart; i++) {
+
+    double s = (px[i]-cen.x())*dir.x() + (py[i]-cen.y())*dir.y() + (pz[i]-cen.z())*dir.z();
+
+    px[i] += tx[i]*s;
+    py[i] += ty[i]*s;
+  }
+
+}//set_hourglass
+
+//_____________________________________________________________________________
+void bunch::generate_slopes(int i0, int i1, unsigned int rseed) {
+
+  //slopes for particles i0 <= i < i1, truncated as the positions
+
+  TRandom3 rnd(rseed);
+
+  double smax = 4;
+
+  for(int i=i0; i<i1; i++) {
+
+    tx[i] = gaus_trunc(rnd, sx/betx, smax);
+    ty[i] = gaus_trunc(rnd, sy/bety, smax);
+  }
+
+}//generate_slopes
+
+//_____________________________________________________________________________
+double bunch::gaus_trunc(TRandom3& rnd, double sig, double smax) {
+
+  //Gaussian with width sig, truncated at |x| < smax*sig
+
+  double x = 0;
+  do {
+    x = rnd.Gaus(0, sig);
+  } while( fabs(x) > smax*sig );
+
+  return x;
+
+}//gaus_trunc
+
+//_____________________________________________________________________________
+unsigned int bunch::block_seed(unsigned long seed, int iblk) {
+
+  //seed for the random stream of a given block of particles, splitmix64 hash
+  //of the bunch seed and block index, nonzero for TRandom3
+
+  unsigned long long z = (unsigned long long)seed*0x9e3779b97f4a7c15ULL + iblk + 1;
+
+  z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+  z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+  z = z ^ (z >> 31);
+
+  return (unsigned int)(z % 4294967295ULL) + 1;
+
+}//block_seed
+
 //_____________________________________________________________________________
 void bunch::rotate_y(double a) {
 
-  //rotate individual particles along y, angle a in mrad
+  //rotate individual particles along y, angle a in mrad,
+  //same convention as TVector3::RotateY
+
+  sync_points();
+
+  double c = cos(a*1e-3);
+  double s = sin(a*1e-3);
+
+  double *x = px.data();
+  double *z = pz.data();
+  int np = px.size();
 
-  for(int i=0; i<points.size(); i++) {
+  for(int i=0; i<np; i++) {
 
-    points[i].RotateY(a*1e-3);
+    double zz = z[i];
+    z[i] = c*zz - s*x[i];
+    x[i] = s*zz + c*x[i];
   }
 
+  tilt += a*1e-3;
+  cen.RotateY(a*1e-3);
+  cen_pts = cen;
+
 }//rotate_y
 
 //_____________________________________________________________________________
@@ -94,14 +343,23 @@ void bunch::set_bins(int nx, double xmin, double xmax, int ny, double ymin, doub
 
   //hxyz.SetBins(60, -2, 2, 60, -2, 2, 60, -200, 200);
 
-  hxyz.SetBins(nx, xmin, xmax, ny, ymin, ymax, nz, zmin, zmax);
+  dens.set_bins(nx, xmin, xmax, ny, ymin, ymax, nz, zmin, zmax);
+
+  //no bins occupied
+  for(int ia=0; ia<3; ia++) {
+    blo[ia] = 1;
+    bhi[ia] = 0;
+  }
 
   //initial particle distribution
-  hxyz.Reset();
+  if( nsub > 0 ) {
 
-  for(auto i: points) {
+    make_ref();
+    fill_shift();
 
-    hxyz.Fill(i.x(), i.y(), i.z());
+  } else {
+
+    fill_dens();
   }
 
 }//set_bins
@@ -111,22 +369,576 @@ void bunch::move(double dt) {
 
   //dt in ns
   double ds = vel*dt;
-  auto delt = TVector3(ds*dir.x(), ds*dir.y(), ds*dir.z());
+  double dx = ds*dir.x();
+  double dy = ds*dir.y();
+  double dz = ds*dir.z();
+
+  cen += TVector3(dx, dy, dz);
 
-  for(int i=0; i<points.size(); i++) {
+  //shifted binning, particles are translated only when needed
+  if( nsub > 0 ) {
 
-    points[i] += delt;
+    fill_shift();
+    return;
   }
 
+  //translate all particles, with their own slopes for the hourglass
+  propagate(dx, dy, dz, ds);
+
+  cen_pts = cen;
+
   //particle distribution
-  hxyz.Reset();
+  fill_dens();
+
+}//move
+
+//_____________________________________________________________________________
+void bunch::propagate(double dx, double dy, double dz, double ds) {
+
+  //particles translated by (dx, dy, dz), one pass per coordinate, and in x and y
+  //by their slopes times path length ds when set for the hourglass
+
+  int np = px.size();
+  double *x = px.data();
+  double *y = py.data();
+  double *z = pz.data();
+
+  if( tx.empty() ) {
 
-  for(auto i: points) {
+    for(int i=0; i<np; i++) x[i] += dx;
+    for(int i=0; i<np; i++) y[i] += dy;
+    for(int i=0; i<np; i++) z[i] += dz;
 
-    hxyz.Fill(i.x(), i.y(), i.z());
+    return;
   }
 
-}//move
+  const double *ax = tx.data();
+  const double *ay = ty.data();
+
+  par_for(np, nthr, [=](int, int i0, int i1) {
+
+    for(int i=i0; i<i1; i++) x[i] += dx + ds*ax[i];
+    for(int i=i0; i<i1; i++) y[i] += dy + ds*ay[i];
+    for(int i=i0; i<i1; i++) z[i] += dz;
+  });
+
+}//propagate
+
+//_____________________________________________________________________________
+void bunch::get_zrange(double& zlo, double& zhi) {
+
+  //extent of particles in z relative to the bunch center
+
+  zlo = 0;
+  zhi = 0;
+
+  if( pz.empty() ) return;
+
+  zlo = zhi = pz[0];
+  for(size_t i=1; i<pz.size(); i++) {
+    zlo = min(zlo, pz[i]);
+    zhi = max(zhi, pz[i]);
+  }
+
+  zlo -= cen_pts.z();
+  zhi -= cen_pts.z();
+
+}//get_zrange
+
+//_____________________________________________________________________________
+void bunch::get_extent(double dt, double *lo, double *hi) {
+
+  //extent of particles along x, y and z at time dt (ns) from the present
+  //position, with the slopes for the hourglass, the bunch is not moved
+
+  double ds = vel*dt;
+
+  double *pos[3] = {px.data(), py.data(), pz.data()};
+  const double *slope[3] = {tx.data(), ty.data(), 0};
+  double d[3] = {cen.x()-cen_pts.x() + ds*dir.x(), cen.y()-cen_pts.y() + ds*dir.y(), cen.z()-cen_pts.z() + ds*dir.z()};
+
+  int np = px.size();
+
+  for(int ia=0; ia<3; ia++) {
+
+    lo[ia] = hi[ia] = 0;
+    if( np == 0 ) continue;
+
+    const double *p = pos[ia];
+    const double *a = tx.empty() ? 0 : slope[ia];
+
+    lo[ia] = hi[ia] = a ? p[0] + ds*a[0] : p[0];
+    for(int i=1; i<np; i++) {
+      double v = a ? p[i] + ds*a[i] : p[i];
+      lo[ia] = min(lo[ia], v);
+      hi[ia] = max(hi[ia], v);
+    }
+
+    lo[ia] += d[ia];
+    hi[ia] += d[ia];
+  }
+
+}//get_extent
+
+//_____________________________________________________________________________
+void bunch::clear_dens() {
+
+  //release bricks from previous fill
+
+  dens.clear();
+
+}//clear_dens
+
+//_____________________________________________________________________________
+void bunch::fill_dens() {
+
+  metrics_timer tfill(met.t_fill);
+
+  clear_dens();
+
+  int np = px.size();
+
+  //no bins occupied without particles
+  if( np == 0 ) {
+    for(int ia=0; ia<3; ia++) {
+      blo[ia] = 1;
+      bhi[ia] = 0;
+    }
+    return;
+  }
+
+  //bins and particle extent in chunks of particles
+  int nthr_fill = par_nthreads(nthr);
+  vector<double> ext(6*nthr_fill);
+  ixp.resize(np);
+  iyp.resize(np);
+  izp.resize(np);
+
+  par_for(np, nthr_fill, [this, &ext](int ith, int i0, int i1) {
+
+    double *pos[3] = {px.data(), py.data(), pz.data()};
+    double *e = &ext[6*ith];
+
+    for(int ia=0; ia<3; ia++) {
+      e[2*ia] = pos[ia][i0];
+      e[2*ia+1] = pos[ia][i0];
+      for(int i=i0+1; i<i1; i++) {
+        e[2*ia] = min(e[2*ia], pos[ia][i]);
+        e[2*ia+1] = max(e[2*ia+1], pos[ia][i]);
+      }
+    }
+
+    for(int i=i0; i<i1; i++) {
+      ixp[i] = dens.find_bin(0, px[i]);
+      iyp[i] = dens.find_bin(1, py[i]);
+      izp[i] = dens.find_bin(2, pz[i]);
+    }
+  });
+
+  //bricks with particles in the density
+  for(int i=0; i<np; i++) {
+    dens.mark(ixp[i], iyp[i], izp[i]);
+  }
+  dens.alloc();
+
+  //occupied bins from the particle extent
+  for(int ia=0; ia<3; ia++) {
+
+    double vmin = ext[2*ia], vmax = ext[2*ia+1];
+    for(int ith=1; ith<min(nthr_fill, np); ith++) {
+      vmin = min(vmin, ext[6*ith+2*ia]);
+      vmax = max(vmax, ext[6*ith+2*ia+1]);
+    }
+
+    blo[ia] = dens.find_bin(ia, vmin);
+    bhi[ia] = dens.find_bin(ia, vmax);
+  }
+
+  //particles ordered by slices along x with a counting sort, in their
+  //original order within each slice
+  int nsl = bhi[0]-blo[0]+1;
+  vector<int> soff(nsl+1, 0);
+  for(int i=0; i<np; i++) {
+    soff[ixp[i]-blo[0]+1]++;
+  }
+  for(int is=0; is<nsl; is++) {
+    soff[is+1] += soff[is];
+  }
+
+  pord.resize(np);
+  vector<int> spos(soff.begin(), soff.end()-1);
+  for(int i=0; i<np; i++) {
+    pord[spos[ixp[i]-blo[0]]++] = i;
+  }
+
+  //fill in slices along x, each slice takes only its own particles
+  //so the slices don't share any bins
+  int nthr_sl = min(par_nthreads(nthr), nsl);
+
+  //particles inside the bin range in each slice
+  vector<long> nin(nthr_sl, 0);
+
+  par_for(nsl, nthr_sl, [this, &soff, &nin](int ith, int s0, int s1) {
+
+    int nx = dens.get_nbins(0);
+    int ny = dens.get_nbins(1);
+    int nz = dens.get_nbins(2);
+
+    for(int j=soff[s0]; j<soff[s1]; j++) {
+
+      int i = pord[j];
+      int ix = ixp[i];
+      int iy = iyp[i];
+      int iz = izp[i];
+
+      dens.add(ix, iy, iz);
+
+      nin[ith] += ix > 0 and ix <= nx and iy > 0 and iy <= ny and iz > 0 and iz <= nz;
+    }
+  });
+
+  long ntot = 0;
+  for(long i: nin) ntot += i;
+
+  met.n_fill += np;
+  met.n_in += ntot;
+  met.n_over += np - ntot;
+
+}//fill_dens
+
+//_____________________________________________________________________________
+void bunch::sync_points() {
+
+  //translate the particles to the present bunch center, needed only
+  //for the shifted binning where move does not touch the particles
+
+  double dx = cen.x() - cen_pts.x();
+  double dy = cen.y() - cen_pts.y();
+  double dz = cen.z() - cen_pts.z();
+
+  if( dx == 0 and dy == 0 and dz == 0 ) return;
+
+  int np = px.size();
+  double *x = px.data();
+  double *y = py.data();
+  double *z = pz.data();
+
+  for(int i=0; i<np; i++) x[i] += dx;
+  for(int i=0; i<np; i++) y[i] += dy;
+  for(int i=0; i<np; i++) z[i] += dz;
+
+  cen_pts = cen;
+
+}//sync_points
+
+//_____________________________________________________________________________
+const sim_metrics& bunch::get_metrics() {
+
+  //timers and counters with the present memory for particles and density
+
+  met.mem_part = (px.capacity() + py.capacity() + pz.capacity() + tx.capacity() + ty.capacity())*sizeof(double);
+  met.mem_part += (ixp.capacity() + iyp.capacity() + izp.capacity() + pord.capacity())*sizeof(int);
+
+  met.mem_dens = dens.get_mem() + sat.capacity()*sizeof(float);
+
+  return met;
+
+}//get_metrics
+
+//_____________________________________________________________________________
+void bunch::reset_metrics(bool all) {
+
+  //timers and counters to zero, the generation time is kept if not all
+
+  double t_gen = met.t_gen;
+
+  met = sim_metrics();
+
+  if( !all ) met.t_gen = t_gen;
+
+}//reset_metrics
+
+//_____________________________________________________________________________
+void bunch::write_state(FILE *f) {
+
+  //particles and position of the bunch, enough to continue the moves
+  //exactly as without interruption
+
+  int np = px.size();
+  double c[7] = {cen.x(), cen.y(), cen.z(), cen_pts.x(), cen_pts.y(), cen_pts.z(), tilt};
+
+  fwrite(&np, sizeof(int), 1, f);
+  fwrite(c, sizeof(double), 7, f);
+  fwrite(px.data(), sizeof(double), np, f);
+  fwrite(py.data(), sizeof(double), np, f);
+  fwrite(pz.data(), sizeof(double), np, f);
+
+}//write_state
+
+//_____________________________________________________________________________
+bool bunch::read_state(FILE *f) {
+
+  //state from write_state, the bunch must have the same number of particles
+
+  int np = 0;
+  double c[7];
+
+  if( fread(&np, sizeof(int), 1, f) != 1 or np != (int)px.size() ) return false;
+  if( fread(c, sizeof(double), 7, f) != 7 ) return false;
+
+  if( fread(px.data(), sizeof(double), np, f) != (size_t)np ) return false;
+  if( fread(py.data(), sizeof(double), np, f) != (size_t)np ) return false;
+  if( fread(pz.data(), sizeof(double), np, f) != (size_t)np ) return false;
+
+  cen.SetXYZ(c[0], c[1], c[2]);
+  cen_pts.SetXYZ(c[3], c[4], c[5]);
+  tilt = c[6];
+
+  return true;
+
+}//read_state
+
+//_____________________________________________________________________________
+void bunch::make_ref() {
+
+  //particles binned in fine bins (nsub per bin along each axis) at the present
+  //bunch position, stored as summed-volume table for the shifted binning
+
+  metrics_timer tfill(met.t_fill);
+
+  sync_points();
+  cen_ref = cen;
+
+  double *pos[3] = {px.data(), py.data(), pz.data()};
+  int np = px.size();
+
+  //fine bin index for each particle and range of the indices
+  vector<int> idx[3];
+  for(int ia=0; ia<3; ia++) {
+
+    double lo = dens.get_min(ia);
+    double fw = dens.get_width(ia)/nsub;
+
+    idx[ia].resize(np);
+
+    int kmin = 0, kmax = 0;
+    for(int i=0; i<np; i++) {
+
+      int k = (int) floor( (pos[ia][i]-lo)/fw );
+      idx[ia][i] = k;
+
+      if( i == 0 or k < kmin ) kmin = k;
+      if( i == 0 or k > kmax ) kmax = k;
+    }
+
+    kf0[ia] = kmin;
+    nf[ia] = kmax - kmin + 1;
+  }
+
+  //counts in fine bins, offset by one for the zero first row of the table
+  int sy = nf[1]+1;
+  int sz = nf[2]+1;
+
+  sat.assign((size_t)(nf[0]+1)*sy*sz, 0);
+
+  for(int i=0; i<np; i++) {
+
+    sat[ ((size_t)(idx[0][i]-kf0[0]+1)*sy + idx[1][i]-kf0[1]+1)*sz + idx[2][i]-kf0[2]+1 ] += 1;
+  }
+
+  //cumulative sums along z, y and x
+  for(int i=0; i<nf[0]+1; i++) {
+    for(int j=0; j<sy; j++) {
+      for(int k=1; k<sz; k++) {
+        sat[((size_t)i*sy + j)*sz + k] += sat[((size_t)i*sy + j)*sz + k-1];
+      }
+    }
+  }
+  for(int i=0; i<nf[0]+1; i++) {
+    for(int j=1; j<sy; j++) {
+      for(int k=0; k<sz; k++) {
+        sat[((size_t)i*sy + j)*sz + k] += sat[((size_t)i*sy + j-1)*sz + k];
+      }
+    }
+  }
+  for(int i=1; i<nf[0]+1; i++) {
+    for(int j=0; j<sy; j++) {
+      for(int k=0; k<sz; k++) {
+        sat[((size_t)i*sy + j)*sz + k] += sat[((size_t)(i-1)*sy + j)*sz + k];
+      }
+    }
+  }
+
+}//make_ref
+
+//_____________________________________________________________________________
+void bunch::shift_edges(int ia, double d, vector<int>& ie, vector<double>& fe) {
+
+  //positions of bin edges along axis ia in the summed-volume table for bunch
+  //shifted by d from the reference position, as table index ie and fraction fe,
+  //edges are -inf, the n+1 bin edges and +inf, for underflow and overflow bins
+
+  int n = dens.get_nbins(ia);
+  double fw = dens.get_width(ia)/nsub;
+
+  ie.resize(n+3);
+  fe.resize(n+3);
+
+  for(int e=0; e<n+3; e++) {
+
+    double p;
+    if( e == 0 ) {
+      p = 0;
+    } else if( e == n+2 ) {
+      p = nf[ia];
+    } else {
+      p = (e-1)*nsub - d/fw - kf0[ia];
+      if( p < 0 ) p = 0;
+      if( p > nf[ia] ) p = nf[ia];
+    }
+
+    int i = (int) floor(p);
+    if( i > nf[ia]-1 ) i = nf[ia]-1;
+
+    ie[e] = i;
+    fe[e] = p - i;
+  }
+
+}//shift_edges
+
+//_____________________________________________________________________________
+void bunch::fill_shift() {
+
+  //distribution from the reference summed-volume table translated by the
+  //bunch motion, linear interpolation in the table for sub-bin shifts
+
+  metrics_timer tfill(met.t_fill);
+
+  vector<int> ie[3];
+  vector<double> fe[3];
+
+  shift_edges(0, cen.x()-cen_ref.x(), ie[0], fe[0]);
+  shift_edges(1, cen.y()-cen_ref.y(), ie[1], fe[1]);
+  shift_edges(2, cen.z()-cen_ref.z(), ie[2], fe[2]);
+
+  //range of edges enclosing the table along each axis, bins outside are empty
+  int e0[3], e1[3];
+  for(int ia=0; ia<3; ia++) {
+
+    int ne = ie[ia].size();
+
+    e0[ia] = 0;
+    while( e0[ia] < ne-2 and ie[ia][e0[ia]+1] == 0 and fe[ia][e0[ia]+1] == 0 ) e0[ia]++;
+
+    e1[ia] = ne-1;
+    while( e1[ia] > e0[ia]+1 and ie[ia][e1[ia]-1] == nf[ia]-1 and fe[ia][e1[ia]-1] == 1 ) e1[ia]--;
+  }
+
+  int ne[3] = {e1[0]-e0[0]+1, e1[1]-e0[1]+1, e1[2]-e0[2]+1};
+
+  //clear bins from previous fill and set the new occupied bins
+  clear_dens();
+
+  for(int ia=0; ia<3; ia++) {
+    blo[ia] = e0[ia];
+    bhi[ia] = e1[ia]-1;
+  }
+
+  dens.alloc_box(blo, bhi);
+
+  int sy = nf[1]+1;
+  int sz = nf[2]+1;
+
+  //cumulative counts at the bin edges, in slices along x
+  vector<double> cum((size_t)ne[0]*ne[1]*ne[2]);
+
+  par_for(ne[0], nthr, [&](int, int ex0, int ex1) {
+
+    for(int ex=ex0; ex<ex1; ex++) {
+      int jx = ie[0][e0[0]+ex];
+      double fx = fe[0][e0[0]+ex];
+      for(int ey=0; ey<ne[1]; ey++) {
+        int jy = ie[1][e0[1]+ey];
+        double fy = fe[1][e0[1]+ey];
+        for(int ez=0; ez<ne[2]; ez++) {
+          int jz = ie[2][e0[2]+ez];
+          double fz = fe[2][e0[2]+ez];
+
+          double val = 0;
+          for(int a=0; a<2; a++) {
+            double wa = a == 0 ? 1-fx : fx;
+            for(int b=0; b<2; b++) {
+              double wb = b == 0 ? 1-fy : fy;
+              const float *row = &sat[((size_t)(jx+a)*sy + jy+b)*sz + jz];
+
+              val += wa*wb*( (1-fz)*row[0] + fz*row[1] );
+            }
+          }
+          cum[((size_t)ex*ne[1] + ey)*ne[2] + ez] = val;
+
+        }//z
+      }//y
+    }//x
+
+  });
+
+  //bin contents from differences of the cumulative counts
+  par_for(ne[0]-1, nthr, [&](int, int ix0, int ix1) {
+
+    for(int ix=ix0; ix<ix1; ix++) {
+      for(int iy=0; iy<ne[1]-1; iy++) {
+        for(int iz=0; iz<ne[2]-1; iz++) {
+
+          double val = 0;
+          for(int a=0; a<2; a++) {
+            for(int b=0; b<2; b++) {
+              for(int c=0; c<2; c++) {
+
+                double sgn = (a+b+c) % 2 == 1 ? 1 : -1;
+
+                val += sgn*cum[((size_t)(ix+a)*ne[1] + iy+b)*ne[2] + iz+c];
+              }
+            }
+          }
+          if( val < 1e-9 ) continue;
+
+          dens.set(e0[0]+ix, e0[1]+iy, e0[2]+iz, val);
+
+        }//z
+      }//y
+    }//x
+
+  });
+
+  //particles inside the bin range from the cumulative counts at its edges, edge e is
+  //the lower edge of bin e, the counts are constant below e0 and above e1 along each axis
+  int cx[2], cy[2], cz[2];
+  for(int k=0; k<2; k++) {
+    cx[k] = min(max(k == 0 ? 1 : dens.get_nbins(0)+1, e0[0]), e1[0]) - e0[0];
+    cy[k] = min(max(k == 0 ? 1 : dens.get_nbins(1)+1, e0[1]), e1[1]) - e0[1];
+    cz[k] = min(max(k == 0 ? 1 : dens.get_nbins(2)+1, e0[2]), e1[2]) - e0[2];
+  }
+
+  double vin = 0;
+  for(int a=0; a<2; a++) {
+    for(int b=0; b<2; b++) {
+      for(int c=0; c<2; c++) {
+
+        double sgn = (a+b+c) % 2 == 1 ? 1 : -1;
+
+        vin += sgn*cum[((size_t)cx[a]*ne[1] + cy[b])*ne[2] + cz[c]];
+      }
+    }
+  }
+
+  long np = px.size();
+  long nin = lround(vin);
+
+  met.n_fill += np;
+  met.n_in += nin;
+  met.n_over += np - nin;
+
+}//fill_shift
 
 //_____________________________________________________________________________
 void bunch::print() {
@@ -135,9 +947,11 @@ void bunch::print() {
 
   //cout << "hi from bunch: " << id << endl;
 
-  for(auto i: points) {
+  sync_points();
 
-    cout << i.x() << " " << i.y() << " " << i.z() << endl;
+  for(size_t i=0; i<px.size(); i++) {
+
+    cout << px[i] << " " << py[i] << " " << pz[i] << endl;
 
   }
 
@@ -146,9 +960,14 @@ void bunch::print() {
 //_____________________________________________________________________________
 void bunch::draw() {
 
-  for(int i=0; i<points.size(); i++) {
+  sync_points();
+
+  //points made only for drawing
+  gr.Set(px.size());
+
+  for(size_t i=0; i<px.size(); i++) {
 
-    gr.SetPoint(i, points[i].z(), points[i].x());
+    gr.SetPoint(i, pz[i], px[i]);
 
   }
 
@@ -160,6 +979,8 @@ void bunch::draw() {
 //_____________________________________________________________________________
 void bunch::draw_xy() {
 
+  dens.fill_th3(hxyz);
+
   auto profile = hxyz.Project3DProfile("yx");
 
   profile->SetContour(300);
@@ -171,6 +992,8 @@ void bunch::draw_xy() {
 //_____________________________________________________________________________
 void bunch::draw_z() {
 
+  dens.fill_th3(hxyz);
+
   auto profile_z = hxyz.ProjectionZ();
 
   profile_z->Draw("same");
@@ -186,9 +1009,27 @@ bunch* make_bunch(int npart, double rmsx, double bsx, double rmsy, double bsy, d
 
   //return new bunch(npart, 24, 59, 2, 5.7, 0.9);
 
-  return new bunch(npart, rmsx, bsx, rmsy, bsy, rmsz);
+  //seed from the global generator, all cores
+  return new bunch(npart, rmsx, bsx, rmsy, bsy, rmsz, gRandom->Integer(kMaxUInt), 0);
 }//make_bunch
 
+//bunch with explicit seed and number of threads (all cores for nthr = 0),
+//the particles depend only on the seed
+bunch* make_bunch_gen(int npart, double rmsx, double bsx, double rmsy, double bsy, double rmsz, unsigned long seed, int nthr) {
+
+  return new bunch(npart, rmsx, bsx, rmsy, bsy, rmsz, seed, nthr);
+}//make_bunch_gen
+
+//bunch as from make_bunch_gen, particles are taken from the cache in cache_dir
+//when present, the cache is limited to cache_mb megabytes
+bunch* make_bunch_cache(int npart, double rmsx, double bsx, double rmsy, double bsy, double rmsz, unsigned long seed, int nthr,
+  const char *cache_dir, double cache_mb) {
+
+  return new bunch(npart, rmsx, bsx, rmsy, bsy, rmsz, seed, nthr, cache_dir, cache_mb);
+}//make_bunch_cache
+
+void bunch_delete(bunch *b) { delete b; }
+
 void bunch_rotate_y(bunch *b, double a) {
 
   b->rotate_y(a);
@@ -198,6 +1039,10 @@ void bunch_set_kinematics(bunch& b, double en, double m, double dx, double dy, d
 
 void bunch_move(bunch& b, double dt) {b.move(dt);}
 
+void bunch_set_intensity(bunch& b, double n) { b.set_intensity(n); }
+
+void bunch_set_hourglass(bunch& b) { b.set_hourglass(); }
+
 void bunch_set_color(bunch& b, Color_t col) {
 
   b.set_color(col);
@@ -213,9 +1058,28 @@ void bunch_draw(bunch& b) {
   b.draw();
 }//bunch_draw
 
+void bunch_set_shift(bunch& b, int nsub) { b.set_shift(nsub); }
+
+void bunch_set_single(bunch& b, bool single) { b.set_single(single); }
+
+void bunch_set_nthreads(bunch& b, int nthr) { b.set_nthreads(nthr); }
+
 void bunch_draw_xy(bunch& b) { b.draw_xy(); }
 void bunch_draw_z(bunch& b) { b.draw_z(); }
 
+//particle coordinates as pointers to the contiguous arrays owned by the bunch,
+//returns the number of particles
+int bunch_get_xyz(bunch& b, double **x, double **y, double **z) {
+
+  b.sync_points();
+
+  *x = b.get_x();
+  *y = b.get_y();
+  *z = b.get_z();
+
+  return b.get_np();
+}//bunch_get_xyz
+
 }//extern "C"
 
 
@@ -0,0 +1,210 @@
+
+//_____________________________________________________________________________
+//
+// Cache of generated bunch particles
+//
+// One file per bunch in the cache directory, named by a hash of the key with
+// the generator parameters and seed. The file has a fixed header followed by
+// the x, y and z coordinates as contiguous arrays, and is mapped to memory
+// when read. Files are written under a temporary name and renamed, so that
+// several processes can share the directory. A file is touched when it is
+// used and the least recently used files are removed when the total size
+// is above the limit.
+//
+//_____________________________________________________________________________
+
+//C++
+#include <iostream>
+#include <vector>
+#include <algorithm>
+#include <cstring>
+#include <cstdio>
+#include <cstdint>
+
+//POSIX
+#include <dirent.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include <utime.h>
+
+//local classes
+#include "bunch_cache.h"
+
+using namespace std;
+
+//file identifier and header
+static const char cache_magic[9] = "EBSBNCH1";
+
+struct cache_header {
+  char magic[8];
+  uint64_t hash; // hash of the key
+  int64_t np; // number of particles
+  char key[232]; // key, for a check against hash collisions
+};
+
+//_____________________________________________________________________________
+static uint64_t cache_hash(const string& key) {
+
+  //64-bit FNV-1a
+
+  uint64_t h = 14695981039346656037ULL;
+  for(unsigned char c: key) {
+    h ^= c;
+    h *= 1099511628211ULL;
+  }
+
+  return h;
+
+}//cache_hash
+
+//_____________________________________________________________________________
+bunch_cache::bunch_cache(const char *d, double size_mb): dir(d), max_size(size_mb*1024*1024) {
+
+  mkdir(dir.c_str(), 0755);
+
+}//bunch_cache
+
+//_____________________________________________________________________________
+string bunch_cache::file_name(const string& key) {
+
+  char nam[64];
+  snprintf(nam, sizeof(nam), "bunch_%016llx.bin", (unsigned long long)cache_hash(key));
+
+  return dir + "/" + nam;
+
+}//file_name
+
+//_____________________________________________________________________________
+bool bunch_cache::read(const string& key, int np, double *x, double *y, double *z) {
+
+  //particles for the key, false when not in the cache
+
+  string nam = file_name(key);
+
+  int fd = open(nam.c_str(), O_RDONLY);
+  if( fd < 0 ) return false;
+
+  struct stat st;
+  size_t nbytes = sizeof(cache_header) + 3*sizeof(double)*(size_t)np;
+
+  if( fstat(fd, &st) != 0 or (size_t)st.st_size != nbytes ) {
+    close(fd);
+    return false;
+  }
+
+  void *map = mmap(0, nbytes, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+
+  if( map == MAP_FAILED ) return false;
+
+  //header must match the key in full
+  const cache_header *hdr = (const cache_header*) map;
+
+  bool ok = memcmp(hdr->magic, cache_magic, 8) == 0 and hdr->hash == cache_hash(key) and hdr->np == np;
+  ok = ok and strncmp(hdr->key, key.c_str(), sizeof(hdr->key)) == 0;
+
+  if( ok ) {
+
+    //pages are read from the file only as the arrays are copied
+    const double *val = (const double*) ((const char*) map + sizeof(cache_header));
+
+    memcpy(x, val, sizeof(double)*np);
+    memcpy(y, val+np, sizeof(double)*np);
+    memcpy(z, val+2*(size_t)np, sizeof(double)*np);
+
+    //mark as recently used
+    utime(nam.c_str(), 0);
+  }
+
+  munmap(map, nbytes);
+
+  return ok;
+
+}//read
+
+//_____________________________________________________________________________
+void bunch_cache::write(const string& key, int np, const double *x, const double *y, const double *z) {
+
+  //particles for the key, then evict old entries above the size limit
+
+  string nam = file_name(key);
+  string tmp = nam + "." + to_string(getpid()) + ".tmp";
+
+  cache_header hdr;
+  memset(&hdr, 0, sizeof(hdr));
+  memcpy(hdr.magic, cache_magic, 8);
+  hdr.hash = cache_hash(key);
+  hdr.np = np;
+  strncpy(hdr.key, key.c_str(), sizeof(hdr.key)-1);
+
+  FILE *f = fopen(tmp.c_str(), "wb");
+  if( !f ) {
+    cout << "Can't write bunch cache " << tmp << endl;
+    return;
+  }
+
+  bool ok = fwrite(&hdr, sizeof(hdr), 1, f) == 1;
+  ok = ok and fwrite(x, sizeof(double), np, f) == (size_t)np;
+  ok = ok and fwrite(y, sizeof(double), np, f) == (size_t)np;
+  ok = ok and fwrite(z, sizeof(double), np, f) == (size_t)np;
+  ok = (fclose(f) == 0) and ok;
+
+  if( !ok or rename(tmp.c_str(), nam.c_str()) != 0 ) {
+    cout << "Can't write bunch cache " << nam << endl;
+    remove(tmp.c_str());
+    return;
+  }
+
+  evict(nam);
+
+}//write
+
+//_____________________________________________________________________________
+void bunch_cache::evict(const string& keep) {
+
+  //remove the least recently used entries until the total size is below
+  //the limit, the entry just written is kept
+
+  if( max_size <= 0 ) return;
+
+  DIR *d = opendir(dir.c_str());
+  if( !d ) return;
+
+  struct entry {
+    string nam;
+    long size;
+    time_t mtime;
+  };
+  vector<entry> ent;
+  long total = 0;
+
+  while( struct dirent *de = readdir(d) ) {
+
+    string fn = de->d_name;
+    if( fn.compare(0, 6, "bunch_") != 0 or fn.size() < 4 or fn.compare(fn.size()-4, 4, ".bin") != 0 ) continue;
+
+    string nam = dir + "/" + fn;
+
+    struct stat st;
+    if( stat(nam.c_str(), &st) != 0 ) continue;
+
+    ent.push_back( {nam, (long)st.st_size, st.st_mtime} );
+    total += st.st_size;
+  }
+  closedir(d);
+
+  //oldest first
+  sort(ent.begin(), ent.end(), [](const entry& a, const entry& b) { return a.mtime < b.mtime; });
+
+  for(auto& i: ent) {
+
+    if( total <= max_size ) break;
+    if( i.nam == keep ) continue;
+
+    if( remove(i.nam.c_str()) == 0 ) total -= i.size;
+  }
+
+}//evict
+
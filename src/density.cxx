@@ -0,0 +1,165 @@
+
+//_____________________________________________________________________________
+//
+// Particle density on a sparse 3D grid
+//
+// Bins with underflow and overflow along each axis are grouped in bricks
+// of 8x8x8 bins, a table gives the position of each brick in the storage
+// and only the bricks with particles are allocated, so the memory follows
+// the volume occupied by the bunch and not the number of bins. Contents
+// are in double or single precision, for the overlap kernel in sim. ROOT
+// histograms are made from it only for drawing.
+//
+//_____________________________________________________________________________
+
+//C++
+#include <algorithm>
+
+//ROOT
+#include "TH3D.h"
+
+//local classes
+#include "density.h"
+
+using namespace std;
+
+//_____________________________________________________________________________
+density::density(): single(false) {
+
+  for(int ia=0; ia<3; ia++) {
+    nbin[ia] = 1;
+    vmin[ia] = 0;
+    vmax[ia] = 1;
+  }
+
+  reset();
+
+}//density
+
+//_____________________________________________________________________________
+void density::set_bins(int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax) {
+
+  nbin[0] = nx;
+  vmin[0] = xmin;
+  vmax[0] = xmax;
+
+  nbin[1] = ny;
+  vmin[1] = ymin;
+  vmax[1] = ymax;
+
+  nbin[2] = nz;
+  vmin[2] = zmin;
+  vmax[2] = zmax;
+
+  reset();
+
+}//set_bins
+
+//_____________________________________________________________________________
+void density::set_single(bool s) {
+
+  single = s;
+
+  reset();
+
+}//set_single
+
+//_____________________________________________________________________________
+void density::reset() {
+
+  //no bricks allocated, table of bricks for the present bins
+
+  for(int ia=0; ia<3; ia++) {
+    nbrk[ia] = (nbin[ia]+2+bmask)>>bsh;
+  }
+
+  brk.assign((size_t)nbrk[0]*nbrk[1]*nbrk[2], -1);
+  vector<int>().swap(used);
+
+  vector<double>().swap(dval);
+  vector<float>().swap(fval);
+
+}//reset
+
+//_____________________________________________________________________________
+void density::clear() {
+
+  //release all bricks, the storage is kept for the next fill
+
+  for(int k: used) {
+    brk[k] = -1;
+  }
+  used.clear();
+
+}//clear
+
+//_____________________________________________________________________________
+void density::alloc() {
+
+  //zero contents for the bricks from mark, only in the selected precision
+
+  size_t n = used.size()<<(3*bsh);
+
+  if( single ) {
+    fval.assign(n, 0);
+  } else {
+    dval.assign(n, 0);
+  }
+
+}//alloc
+
+//_____________________________________________________________________________
+void density::alloc_box(const int *lo, const int *hi) {
+
+  //all bricks with the bins lo <= i <= hi along each axis
+
+  for(int bx=lo[0]>>bsh; bx<(hi[0]>>bsh)+1; bx++) {
+    for(int by=lo[1]>>bsh; by<(hi[1]>>bsh)+1; by++) {
+      for(int bz=lo[2]>>bsh; bz<(hi[2]>>bsh)+1; bz++) {
+
+        mark(bx<<bsh, by<<bsh, bz<<bsh);
+      }
+    }
+  }
+
+  alloc();
+
+}//alloc_box
+
+//_____________________________________________________________________________
+size_t density::get_mem() const {
+
+  //bytes in the table of bricks and in the storage
+
+  return brk.capacity()*sizeof(int) + used.capacity()*sizeof(int) + dval.capacity()*sizeof(double) + fval.capacity()*sizeof(float);
+
+}//get_mem
+
+//_____________________________________________________________________________
+void density::fill_th3(TH3D& h) const {
+
+  h.SetBins(nbin[0], vmin[0], vmax[0], nbin[1], vmin[1], vmax[1], nbin[2], vmin[2], vmax[2]);
+  h.Reset(); // SetBins keeps the contents at the same number of bins
+
+  //bins in the allocated bricks
+  for(int k: used) {
+
+    int bz = k % nbrk[2];
+    int by = (k / nbrk[2]) % nbrk[1];
+    int bx = k / (nbrk[2]*nbrk[1]);
+
+    for(int ix=bx<<bsh; ix<min((bx+1)<<bsh, nbin[0]+2); ix++) {
+      for(int iy=by<<bsh; iy<min((by+1)<<bsh, nbin[1]+2); iy++) {
+        for(int iz=bz<<bsh; iz<min((bz+1)<<bsh, nbin[2]+2); iz++) {
+
+          double val = get(ix, iy, iz);
+          if( val == 0 ) continue;
+
+          h.SetBinContent(ix, iy, iz, val);
+        }
+      }
+    }
+  }
+
+}//fill_th3
+
@@ -0,0 +1,213 @@
+
+//_____________________________________________________________________________
+//
+// Analytic overlap of two Gaussian bunches
+//
+// Each bunch is taken as the 3D Gaussian it was generated from, rotated by
+// its tilt along y and moving with its velocity. The product of the two
+// densities is a Gaussian in time at each point in space, the time integral
+// over (tmin, tmax) is done in closed form and the space integral by the
+// midpoint rule at the bin centers. Outputs are the same time integrals
+// along x, y and z as in sim::run_evolution, without sampling particles.
+//
+//_____________________________________________________________________________
+
+//C++
+#include <iostream>
+#include <math.h>
+
+//ROOT
+#include "TVector3.h"
+#include "TGraph.h"
+#include "TFile.h"
+#include "TMath.h"
+
+//local classes
+#include "bunch.h"
+#include "gaus_overlap.h"
+
+using namespace std;
+
+//_____________________________________________________________________________
+gaus_overlap::gaus_overlap(): total(0) {
+
+}//gaus_overlap
+
+//_____________________________________________________________________________
+void gaus_overlap::set_bins(int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax) {
+
+  hxt.SetBins(nx, xmin, xmax);
+  hyt.SetBins(ny, ymin, ymax);
+  hzt.SetBins(nz, zmin, zmax);
+
+}//set_bins
+
+//_____________________________________________________________________________
+void gaus_overlap::make_amat(bunch *b, double *amat) {
+
+  //inverse covariance matrix in lab frame, A = R D R^T with D = diag(1/sigma^2)
+  //and R the rotation along y, stored as 3x3 row-major
+
+  double c = cos(b->get_tilt());
+  double s = sin(b->get_tilt());
+
+  double dx = 1./(b->get_sx()*b->get_sx());
+  double dy = 1./(b->get_sy()*b->get_sy());
+  double dz = 1./(b->get_sz()*b->get_sz());
+
+  //R = ((c, 0, s), (0, 1, 0), (-s, 0, c)), same convention as TVector3::RotateY
+  amat[0] = c*c*dx + s*s*dz;
+  amat[1] = 0;
+  amat[2] = -c*s*dx + s*c*dz;
+  amat[3] = 0;
+  amat[4] = dy;
+  amat[5] = 0;
+  amat[6] = amat[2];
+  amat[7] = 0;
+  amat[8] = s*s*dx + c*c*dz;
+
+}//make_amat
+
+//_____________________________________________________________________________
+void gaus_overlap::run(bunch *b0, bunch *b1, double tmin, double tmax) {
+
+  //overlap of bunches b0 and b1 integrated over time from tmin to tmax in ns,
+  //times are relative to the present bunch positions
+
+  hxt.Reset();
+  hyt.Reset();
+  hzt.Reset();
+  total = 0;
+
+  bunch *bb[2] = {b0, b1};
+
+  double amat[2][9]; // inverse covariance matrices
+  double cen[2][3]; // bunch centers, mm
+  double wv[2][3]; // bunch velocities, mm/ns
+  double aw[2][3]; // A.w
+  double norm = 1; // product of Gaussian normalizations
+
+  for(int k=0; k<2; k++) {
+
+    make_amat(bb[k], amat[k]);
+
+    const TVector3& c = bb[k]->get_cen();
+    cen[k][0] = c.x();
+    cen[k][1] = c.y();
+    cen[k][2] = c.z();
+
+    const TVector3& d = bb[k]->get_dir();
+    wv[k][0] = bb[k]->get_vel()*d.x();
+    wv[k][1] = bb[k]->get_vel()*d.y();
+    wv[k][2] = bb[k]->get_vel()*d.z();
+
+    for(int i=0; i<3; i++) {
+      aw[k][i] = 0;
+      for(int j=0; j<3; j++) aw[k][i] += amat[k][3*i+j]*wv[k][j];
+    }
+
+    norm *= 1./( pow(2*TMath::Pi(), 1.5)*bb[k]->get_sx()*bb[k]->get_sy()*bb[k]->get_sz() );
+  }
+
+  //quadratic coefficient in time, a = sum_k w^T A w
+  double a = 0;
+  for(int k=0; k<2; k++) {
+    for(int i=0; i<3; i++) a += wv[k][i]*aw[k][i];
+  }
+
+  //kinematic (Moller) factor for the flux of the two bunches, mm/ns
+  double light = 299.792; // mm/ns
+  TVector3 v0(wv[0][0], wv[0][1], wv[0][2]);
+  TVector3 v1(wv[1][0], wv[1][1], wv[1][2]);
+  double kfac = sqrt( (v0-v1).Mag2() - v0.Cross(v1).Mag2()/(light*light) );
+
+  TAxis *ax = hxt.GetXaxis();
+  TAxis *ay = hyt.GetXaxis();
+  TAxis *az = hzt.GetXaxis();
+
+  double vbin = ax->GetBinWidth(1)*ay->GetBinWidth(1)*az->GetBinWidth(1);
+
+  for(int ix=1; ix<ax->GetNbins()+1; ix++) {
+    for(int iy=1; iy<ay->GetNbins()+1; iy++) {
+      for(int iz=1; iz<az->GetNbins()+1; iz++) {
+
+        double r[3] = {ax->GetBinCenter(ix), ay->GetBinCenter(iy), az->GetBinCenter(iz)};
+
+        //linear and constant coefficients in time, b = sum_k w^T A d, c = sum_k d^T A d
+        double b = 0, c = 0;
+        for(int k=0; k<2; k++) {
+
+          double d[3] = {r[0]-cen[k][0], r[1]-cen[k][1], r[2]-cen[k][2]};
+
+          for(int i=0; i<3; i++) {
+
+            b += aw[k][i]*d[i];
+
+            double ad = 0;
+            for(int j=0; j<3; j++) ad += amat[k][3*i+j]*d[j];
+            c += d[i]*ad;
+          }
+        }
+
+        //integral of exp(-(a t^2 - 2 b t + c)/2) over tmin < t < tmax
+        double tint;
+        if( a > 0 ) {
+
+          double t0 = b/a;
+          double sa = sqrt(a/2);
+          tint = exp(-(c - b*t0)/2) * sqrt(TMath::Pi()/(2*a)) * ( TMath::Erf(sa*(tmax-t0)) - TMath::Erf(sa*(tmin-t0)) );
+
+        } else {
+
+          //both bunches at rest
+          tint = exp(-c/2)*(tmax-tmin);
+        }
+
+        double val = kfac*norm*tint*vbin;
+
+        hxt.AddBinContent(ix, val);
+        hyt.AddBinContent(iy, val);
+        hzt.AddBinContent(iz, val);
+
+        total += val;
+
+      }//z
+    }//y
+  }//x
+
+}//run
+
+//_____________________________________________________________________________
+void gaus_overlap::write(const char *nam) {
+
+  TFile out(nam, "recreate");
+
+  hxt.Write("hxt");
+  hyt.Write("hyt");
+  hzt.Write("hzt");
+
+  out.Close();
+
+}//write
+
+//_____________________________________________________________________________
+extern "C" {
+
+  gaus_overlap *make_gaus_overlap() { return new gaus_overlap(); }
+
+  void gaus_overlap_set_bins(gaus_overlap& g, int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax) {
+    g.set_bins(nx, xmin, xmax, ny, ymin, ymax, nz, zmin, zmax);
+  }
+
+  void gaus_overlap_run(gaus_overlap& g, bunch *b0, bunch *b1, double tmin, double tmax) { g.run(b0, b1, tmin, tmax); }
+
+  double gaus_overlap_get_total(gaus_overlap& g) { return g.get_total(); }
+
+  void gaus_overlap_write(gaus_overlap& g, const char *nam) { g.write(nam); }
+
+  void gaus_overlap_draw_xt(gaus_overlap& g) { g.draw_xt(); }
+  void gaus_overlap_draw_yt(gaus_overlap& g) { g.draw_yt(); }
+  void gaus_overlap_draw_zt(gaus_overlap& g) { g.draw_zt(); }
+
+}
+
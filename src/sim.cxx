@@ -7,38 +7,136 @@
 
 //C++
 #include <iostream>
+#include <algorithm>
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <unistd.h>
 
 //ROOT
 #include "TGraph.h"
 #include "TVector3.h"
 #include "TFile.h"
+#include "TMath.h"
 
 //local classes
 #include "bunch.h"
 #include "sim.h"
+#include "gaus_overlap.h"
+#include "par.h"
 
 using namespace std;
 
+//checkpoint file identifier and format version
+static const char ckmagic[9] = "EBSCKPT3";
+
 //_____________________________________________________________________________
-sim::sim() {
+sim::sim(): sched_len(0), ncoarse(0), xymax(0), tcur(0), nthr(1), kernel(0), outnam("sim.root"), ckevery(0), ckhash(0), met(), progress(0) {
+
+  for(int ia=0; ia<3; ia++) {
+    nbin[ia] = 0;
+    bmin[ia] = bmax[ia] = 0;
+  }
 
 }//sim
 
+//_____________________________________________________________________________
+void sim::add_bunch(bunch *b, int sd, double toff) {
+
+  //bunch on side sd, 0 for hadrons and 1 for electrons, for sd < 0 the first
+  //bunch is on side 0 and the others on side 1; the present state of the bunch
+  //is for time toff, so the bunch reaches the interaction point later by toff
+
+  if( sd < 0 ) sd = bunches.empty() ? 0 : 1;
+
+  bunches.push_back(b);
+  side.push_back(sd);
+  tb.push_back(toff);
+
+}//add_bunch
+
 //_____________________________________________________________________________
 void sim::move(double dt) {
 
-  for(auto i = bunches.begin(); i<bunches.end(); i++) {
+  tcur += dt;
 
-    (*i)->move(dt);
+  //bunches in trains are moved when they cross
+  if( trains() ) {
+    make_pairs();
+    return;
+  }
+
+  for(size_t i=0; i<bunches.size(); i++) {
+
+    bunches[i]->move(dt);
+    tb[i] += dt;
   }
 
   make_pairs();
 
 }//move
 
+//_____________________________________________________________________________
+void sim::set_shift(int nsub) {
+
+  //shifted binning for all bunches with nsub fine bins per bin,
+  //to be called before set_bins, not for bunches with the hourglass
+  //as the density changes its shape along the motion
+
+  for(auto i = bunches.begin(); i<bunches.end(); i++) {
+
+    if( (*i)->get_hourglass() ) {
+      cout << "Shifted binning not used with the hourglass" << endl;
+      continue;
+    }
+
+    (*i)->set_shift(nsub);
+  }
+
+}//set_shift
+
+//_____________________________________________________________________________
+void sim::set_single(bool single) {
+
+  //single precision density in all bunches, to be called before set_bins
+
+  for(auto i = bunches.begin(); i<bunches.end(); i++) {
+
+    (*i)->set_single(single);
+  }
+
+}//set_single
+
+//_____________________________________________________________________________
+void sim::set_nthreads(int n) {
+
+  //threads for the fill in bunches and for the pairs, all cores for n = 0
+
+  nthr = n;
+
+  for(auto i = bunches.begin(); i<bunches.end(); i++) {
+
+    (*i)->set_nthreads(n);
+  }
+
+}//set_nthreads
+
 //_____________________________________________________________________________
 void sim::set_bins(int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax) {
 
+  //ranges around the overlap from the coarse pilot, the given ranges are kept if not found
+  if( ncoarse > 0 ) {
+
+    double vlo[3] = {xmin, ymin, zmin};
+    double vhi[3] = {xmax, ymax, zmax};
+
+    pilot_ranges(vlo, vhi);
+
+    xmin = vlo[0]; xmax = vhi[0];
+    ymin = vlo[1]; ymax = vhi[1];
+    zmin = vlo[2]; zmax = vhi[2];
+  }
+
   for(auto i = bunches.begin(); i<bunches.end(); i++) {
 
     (*i)->set_bins(nx, xmin, xmax, ny, ymin, ymax, nz, zmin, zmax);
@@ -47,44 +145,251 @@ void sim::set_bins(int nx, double xmin, double xmax, int ny, double ymin, double
   hxy.SetBins(nx, xmin, xmax, ny, ymin, ymax);
   hz.SetBins(nz, zmin, zmax);
 
-  make_pairs();
-
-  xymax = hxy.GetMaximum();
-
   hxt.SetBins(nx, xmin, xmax);
   hyt.SetBins(ny, ymin, ymax);
   hzt.SetBins(nz, zmin, zmax);
 
+  nbin[0] = nx;
+  nbin[1] = ny;
+  nbin[2] = nz;
+
+  bmin[0] = xmin; bmax[0] = xmax;
+  bmin[1] = ymin; bmax[1] = ymax;
+  bmin[2] = zmin; bmax[2] = zmax;
+
+  vxt.assign(nx+2, 0);
+  vyt.assign(ny+2, 0);
+  vzt.assign(nz+2, 0);
+
+  make_schedule();
+
+  make_pairs();
+
+  //maximum in xy without underflow and overflow
+  xymax = 0;
+  for(int ix=1; ix<nx+1; ix++) {
+    for(int iy=1; iy<ny+1; iy++) {
+      xymax = max(xymax, vxy[ix*(ny+2)+iy]);
+    }
+  }
+
 }//set_bins
 
 //_____________________________________________________________________________
-void sim::make_pairs() {
+template<bool prod, typename T0, typename T1> static long pairs_kernel(const density& d0, const density& d1, const int *lo, const int *hi,
+  int ny2, double norm, double *vxy, double *vz, long& nvis) {
 
-  hxy.Reset();
-  hz.Reset();
+  //minimum or product times norm of the two densities summed to xy and z,
+  //z is contiguous in the bricks, bricks not allocated in either density are
+  //skipped, returns the number of bins with nonzero pairs, visited bins in nvis
 
-  bunch *b0 = bunches[0];
-  bunch *b1 = bunches[1];
+  const int bsh = density::bsh;
 
-  //electron-proton pairs in bunches
-  for(int ix=0; ix<hxy.GetNbinsX()+1; ix++) {
-    for(int iy=0; iy<hxy.GetNbinsY()+1; iy++) {
-      for(int iz=0; iz<hz.GetNbinsX()+1; iz++) {
+  long nnz = 0;
 
-        double nb0 = b0->get_hxyz().GetBinContent(ix, iy, iz);
-        double nb1 = b1->get_hxyz().GetBinContent(ix, iy, iz);
- 
-        double npair = min(nb0, nb1);
+  for(int ix=lo[0]; ix<hi[0]+1; ix++) {
+    for(int iy=lo[1]; iy<hi[1]+1; iy++) {
 
-        hxy.SetBinContent(ix, iy, npair+hxy.GetBinContent(ix, iy));
-        hz.SetBinContent(iz, npair+hz.GetBinContent(iz));
+      double sxy = 0;
+      for(int bz=lo[2]>>bsh; bz<(hi[2]>>bsh)+1; bz++) {
+
+        const T0 *r0 = d0.row<T0>(ix, iy, bz);
+        const T1 *r1 = d1.row<T1>(ix, iy, bz);
+        if( !r0 or !r1 ) continue;
+
+        int z0 = max(lo[2], bz<<bsh);
+        int z1 = min(hi[2], ((bz+1)<<bsh)-1);
+
+        nvis += z1-z0+1;
+
+        for(int iz=z0; iz<z1+1; iz++) {
+
+          int j = iz & density::bmask;
+          double npair = prod ? norm*r0[j]*r1[j] : min((double)r0[j], (double)r1[j]);
+
+          sxy += npair;
+          vz[iz] += npair;
+          nnz += npair > 0;
+        }
+      }
+
+      vxy[ix*ny2 + iy] += sxy;
 
-      }//z
     }//y
   }//x
 
+  return nnz;
+
+}//pairs_kernel
+
+//_____________________________________________________________________________
+template<bool prod> static long pairs_dens(const density& d0, const density& d1, const int *lo, const int *hi,
+  int ny2, double norm, double *vxy, double *vz, long& nvis) {
+
+  //pairs kernel for the storage precision of the two densities
+
+  if( d0.is_single() ) {
+    if( d1.is_single() ) {
+      return pairs_kernel<prod, float, float>(d0, d1, lo, hi, ny2, norm, vxy, vz, nvis);
+    }
+    return pairs_kernel<prod, float, double>(d0, d1, lo, hi, ny2, norm, vxy, vz, nvis);
+  }
+  if( d1.is_single() ) {
+    return pairs_kernel<prod, double, float>(d0, d1, lo, hi, ny2, norm, vxy, vz, nvis);
+  }
+
+  return pairs_kernel<prod, double, double>(d0, d1, lo, hi, ny2, norm, vxy, vz, nvis);
+
+}//pairs_dens
+
+//_____________________________________________________________________________
+void sim::make_pairs() {
+
+  //pairs at present time, for all crossings active at the time with trains
+
+  vxy.assign((nbin[0]+2)*(nbin[1]+2), 0);
+  vz.assign(nbin[2]+2, 0);
+
+  if( !trains() ) {
+    add_pairs(bunches[0], bunches[1]);
+    return;
+  }
+
+  //crossings with t_in from present time minus the longest finite window
+  auto it = lower_bound(sched.begin(), sched.end(), tcur - sched_len,
+    [](const crossing& c, double t) { return c.t_in < t; });
+
+  for(; it != sched.end() and it->t_in <= tcur; it++) {
+
+    if( it->t_out < tcur or !isfinite(it->t_out - it->t_in) ) continue;
+
+    add_crossing(*it);
+  }
+
+  //crossings without a finite window, bunches at rest in z
+  for(const crossing& c: sched_open) {
+
+    if( c.t_in <= tcur and tcur <= c.t_out ) add_crossing(c);
+  }
+
 }//make_pairs
 
+//_____________________________________________________________________________
+void sim::add_crossing(const crossing& c) {
+
+  //pairs from a crossing, bunches moved to present time when needed
+
+  for(int i: {c.i0, c.i1}) {
+    if( tb[i] == tcur ) continue;
+    bunches[i]->move(tcur - tb[i]);
+    tb[i] = tcur;
+  }
+
+  add_pairs(bunches[c.i0], bunches[c.i1]);
+
+}//add_crossing
+
+//_____________________________________________________________________________
+void sim::add_pairs(bunch *b0, bunch *b1) {
+
+  //pairs from the two bunches added to the present distributions
+
+  metrics_timer tpairs(met.t_pairs);
+
+  met.n_cross++;
+
+  //intersection of occupied bins in the two bunches, bins 0 to nbins along each axis
+  int lo[3], hi[3];
+  for(int ia=0; ia<3; ia++) {
+
+    lo[ia] = max(0, max(b0->get_bin_lo(ia), b1->get_bin_lo(ia)));
+    hi[ia] = min(nbin[ia], min(b0->get_bin_hi(ia), b1->get_bin_hi(ia)));
+
+    //bunches don't overlap
+    if( lo[ia] > hi[ia] ) return;
+  }
+
+  //electron-proton pairs in bunches, in slices along x with partial sums in z
+  const density& d0 = b0->get_dens();
+  const density& d1 = b1->get_dens();
+
+  int ny2 = nbin[1]+2;
+  int nz2 = nbin[2]+2;
+
+  int nsl = hi[0]-lo[0]+1;
+  int nthr_pairs = min(par_nthreads(nthr), nsl);
+
+  //luminosity rate from the product of counts, mm^-2 ns^-1
+  double norm = kernel == 1 ? lumi_norm(b0, b1) : 1;
+
+  //partial sums in z for each slice, merged in the order of the slices
+  //so the sums don't depend on the number of threads
+  vz_part.resize(nsl);
+  vector<long> nnz(nsl, 0), nvis(nsl, 0);
+
+  par_for(nsl, nthr_pairs, [&](int ith, int s0, int s1) {
+
+    for(int is=s0; is<s1; is++) {
+
+      int slo[3] = {lo[0]+is, lo[1], lo[2]};
+      int shi[3] = {lo[0]+is, hi[1], hi[2]};
+
+      vector<double>& pz = vz_part[is];
+      pz.assign(nz2, 0);
+
+      if( kernel == 1 ) {
+        nnz[is] = pairs_dens<true>(d0, d1, slo, shi, ny2, norm, vxy.data(), pz.data(), nvis[is]);
+      } else {
+        nnz[is] = pairs_dens<false>(d0, d1, slo, shi, ny2, norm, vxy.data(), pz.data(), nvis[is]);
+      }
+    }
+  });
+
+  //merge the partial sums in z in fixed order
+  for(int is=0; is<nsl; is++) {
+    for(int iz=lo[2]; iz<hi[2]+1; iz++) {
+
+      vz[iz] += vz_part[is][iz];
+    }
+    met.n_bins_pairs += nnz[is];
+    met.n_bins += nvis[is];
+  }
+
+}//add_pairs
+
+//_____________________________________________________________________________
+double sim::lumi_norm(bunch *b0, bunch *b1) {
+
+  //factor from product of counts in a bin to luminosity rate, the counts are
+  //scaled to bunch intensities and divided by the bin volume for the densities,
+  //times the kinematic (Moller) factor for the flux of the two bunches
+
+  double w0 = b0->get_intensity()/b0->get_np();
+  double w1 = b1->get_intensity()/b1->get_np();
+
+  double light = 299.792; // mm/ns
+  TVector3 v0 = b0->get_dir()*b0->get_vel();
+  TVector3 v1 = b1->get_dir()*b1->get_vel();
+  double kfac = sqrt( (v0-v1).Mag2() - v0.Cross(v1).Mag2()/(light*light) );
+
+  double vbin = hxt.GetXaxis()->GetBinWidth(1)*hyt.GetXaxis()->GetBinWidth(1)*hzt.GetXaxis()->GetBinWidth(1);
+
+  return w0*w1*kfac/vbin;
+
+}//lumi_norm
+
+//_____________________________________________________________________________
+double sim::step_weight(double dt, double dt_ref) {
+
+  //weight of a step of length dt in the time integrals, relative to the uniform
+  //step dt_ref for pairs, the time in ns for luminosity
+
+  if( kernel == 1 ) return dt;
+
+  return dt/dt_ref;
+
+}//step_weight
+
 //_____________________________________________________________________________
 void sim::run_evolution(double tmin, double tmax, int nstep) {
 
@@ -92,32 +397,738 @@ void sim::run_evolution(double tmin, double tmax, int nstep) {
 
   double dt = (tmax-tmin)/nstep;
 
-  move(tmin-dt);
+  //continue from a checkpoint of the same evolution if present
+  vector<double> par = {tmin, tmax, dt};
+  int i0 = 0;
 
-  for(int i=0; i<nstep; i++) {
+  if( !read_checkpoint(0, par, i0, tcur) ) {
+    move(tmin-dt);
+  }
 
-    cout << i << endl;
+  for(int i=i0; i<nstep; i++) {
 
     move(dt);
 
-    for(int ix=0; ix<hxy.GetNbinsX()+1; ix++) {
-      for(int iy=0; iy<hxy.GetNbinsY()+1; iy++) {
+    accumulate( step_weight(dt, dt) );
 
-        hxt.AddBinContent(ix, hxy.GetBinContent(ix, iy));
-        hyt.AddBinContent(iy, hxy.GetBinContent(ix, iy));
+    met.n_step++;
+    if( progress ) progress(i, nstep, tmin + i*dt);
 
-      }//y
-    }//x
+    if( ckevery > 0 and (i+1) % ckevery == 0 and i+1 < nstep ) {
+      write_checkpoint(0, par, i+1, tcur);
+    }
 
-    for(int iz=0; iz<hz.GetNbinsX()+1; iz++) {
+  }//dt
 
-        hzt.AddBinContent(iz, hz.GetBinContent(iz));
+  if( !outnam.empty() ) write(outnam.c_str());
 
-    }//z
+  end_checkpoint();
 
-  }//dt
+}//run_evolution
+
+//_____________________________________________________________________________
+void sim::run_schedule(const double *times, int nt, double *xy_out, double *z_out) {
+
+  //bunches moved to each of the nt times, pairs in xy and z at each time copied
+  //to the outputs of nt*(nx+2)*(ny+2) and nt*(nz+2) values including underflow
+  //and overflow bins, null output is not filled; the time integrals are not changed
+
+  size_t nxy = vxy.size();
+  size_t nz2 = vz.size();
+
+  for(int i=0; i<nt; i++) {
+
+    move(times[i] - tcur);
+
+    if( xy_out ) copy(vxy.begin(), vxy.end(), xy_out + i*nxy);
+    if( z_out ) copy(vz.begin(), vz.end(), z_out + i*nz2);
+
+    met.n_step++;
+    if( progress ) progress(i, nt, times[i]);
+
+  }//times
+
+}//run_schedule
+
+//_____________________________________________________________________________
+void sim::accumulate(double w) {
+
+  //add present pairs to the time integrals with weight w
+
+  int ny2 = nbin[1]+2;
+
+  for(int ix=0; ix<nbin[0]+1; ix++) {
+    for(int iy=0; iy<nbin[1]+1; iy++) {
+
+      vxt[ix] += w*vxy[ix*ny2 + iy];
+      vyt[iy] += w*vxy[ix*ny2 + iy];
+
+    }//y
+  }//x
+
+  for(int iz=0; iz<nbin[2]+1; iz++) {
+
+      vzt[iz] += w*vz[iz];
+
+  }//z
+
+}//accumulate
+
+//_____________________________________________________________________________
+void sim::make_schedule() {
+
+  //time windows for all pairs of hadron and electron bunches which meet within
+  //the bins, ordered by the time they come in; pairs which don't meet there are
+  //left out and cost nothing in the steps
+
+  sched.clear();
+  sched_open.clear();
+  sched_len = 0;
+
+  if( !trains() ) return;
+
+  //extent in z of each bunch along time, made once as it scans the particles
+  vector<ztrack> trk(bunches.size());
+  for(size_t i=0; i<bunches.size(); i++) {
+
+    bunch *b = bunches[i];
+
+    double lo, hi;
+    b->get_zrange(lo, hi);
+
+    //center at time tb from the present state
+    double v = b->get_vel()*b->get_dir().z();
+    double z0 = b->get_cen().z() - v*tb[i];
+
+    trk[i].v = v;
+    trk[i].zlo = z0 + lo;
+    trk[i].zhi = z0 + hi;
+  }
+
+  int npair = 0;
+  for(size_t i0=0; i0<bunches.size(); i0++) {
+    if( side[i0] != 0 ) continue;
+
+    for(size_t i1=0; i1<bunches.size(); i1++) {
+      if( side[i1] != 1 ) continue;
+
+      npair++;
+
+      crossing c;
+      if( !pair_window(trk[i0], trk[i1], c.t_in, c.t_out) ) continue;
+
+      c.i0 = i0;
+      c.i1 = i1;
+      sched.push_back(c);
+
+      //longest finite window for the lookup of active crossings,
+      //crossings without a finite window are looked up apart
+      if( isfinite(c.t_out - c.t_in) ) {
+        sched_len = max(sched_len, c.t_out - c.t_in);
+      } else {
+        sched_open.push_back(c);
+      }
+    }
+  }
+
+  sort(sched.begin(), sched.end(), [](const crossing& a, const crossing& b) { return a.t_in < b.t_in; });
+
+  cout << "Bunch crossings: " << sched.size() << " of " << npair << " bunch pairs" << endl;
+
+}//make_schedule
+
+//_____________________________________________________________________________
+bool sim::pair_window(const ztrack& b0, const ztrack& b1, double& t_in, double& t_out) {
+
+  //time interval where the particle extents in z of the two bunches overlap
+  //each other and the bin range in z, false when there is no such time
+
+  //lower and upper edges in z as m*t + q, for the two bunches and the bins
+  double ml[3] = {b0.v, b1.v, 0};
+  double ql[3] = {b0.zlo, b1.zlo, hzt.GetXaxis()->GetXmin()};
+  double mh[3] = {b0.v, b1.v, 0};
+  double qh[3] = {b0.zhi, b1.zhi, hzt.GetXaxis()->GetXmax()};
+
+  //each lower edge is below each upper edge
+  t_in = -HUGE_VAL;
+  t_out = HUGE_VAL;
+  for(int i=0; i<3; i++) {
+    for(int j=0; j<3; j++) {
+
+      double m = ml[i] - mh[j];
+      double q = ql[i] - qh[j];
+
+      if( fabs(m) < 1e-12 ) {
+        if( q > 0 ) return false;
+        continue;
+      }
+
+      if( m > 0 ) {
+        t_out = min(t_out, -q/m);
+      } else {
+        t_in = max(t_in, -q/m);
+      }
+    }
+  }
+
+  return t_in <= t_out;
+
+}//pair_window
+
+//_____________________________________________________________________________
+void sim::auto_train(int nstep, vector<double>& tlo, vector<double>& thi) {
+
+  //step intervals for the bunch trains, the crossing windows are merged
+  //to disjoint intervals and the steps are shared in proportion to their
+  //lengths, uniform in each interval
+
+  tlo.clear();
+  thi.clear();
+
+  vector< pair<double, double> > win;
+  for(const crossing& c: sched) {
+
+    if( !isfinite(c.t_in) or !isfinite(c.t_out) ) {
+      cout << "Bunches at rest in z, no time window" << endl;
+      return;
+    }
+
+    if( !win.empty() and c.t_in <= win.back().second ) {
+      win.back().second = max(win.back().second, c.t_out);
+    } else {
+      win.push_back( make_pair(c.t_in, c.t_out) );
+    }
+  }
+
+  double len = 0;
+  for(auto& w: win) len += w.second - w.first;
+
+  if( len <= 0 ) return;
+
+  cout << "Crossing windows: " << win.size() << ", total length (ns): " << len << endl;
+
+  for(auto& w: win) {
+
+    int n = max(1, int(round(nstep*(w.second - w.first)/len)));
+    double dt = (w.second - w.first)/n;
+
+    for(int i=0; i<n; i++) {
+      tlo.push_back(w.first + i*dt);
+      thi.push_back(w.first + (i+1)*dt);
+    }
+  }
+
+}//auto_train
+
+//_____________________________________________________________________________
+bool sim::crossing_window(bunch *b0, bunch *b1, double& tmin, double& tmax, double& tc, double& sigt) {
+
+  //time interval where the bunches overlap in z, from present time 0, given by
+  //the particle extents in z moving with the bunch velocities, and the center tc
+  //and width sigt in time for the expected Gaussian overlap rate
+
+  double lo0, hi0, lo1, hi1;
+  b0->get_zrange(lo0, hi0);
+  b1->get_zrange(lo1, hi1);
+
+  //separation d + dv*t of the bunch centers in z
+  double d = b1->get_cen().z() - b0->get_cen().z();
+  double dv = b1->get_vel()*b1->get_dir().z() - b0->get_vel()*b0->get_dir().z();
+
+  //bunches don't approach each other in z
+  if( fabs(dv) < 1e-9 ) return false;
+
+  //overlap for lo0 - hi1 < d + dv*t < hi0 - lo1
+  double t0 = (lo0 - hi1 - d)/dv;
+  double t1 = (hi0 - lo1 - d)/dv;
+
+  tmin = min(t0, t1);
+  tmax = max(t0, t1);
+
+  tc = -d/dv;
+  sigt = sqrt( b0->get_sz()*b0->get_sz() + b1->get_sz()*b1->get_sz() )/fabs(dv);
+
+  return true;
+
+}//crossing_window
+
+//_____________________________________________________________________________
+void sim::first_pair(bunch*& b0, bunch*& b1) {
+
+  //first hadron and first electron bunch, the two bunches for single crossing
+
+  b0 = b1 = 0;
+
+  for(size_t i=0; i<bunches.size(); i++) {
+
+    if( side[i] == 0 and !b0 ) b0 = bunches[i];
+    if( side[i] == 1 and !b1 ) b1 = bunches[i];
+  }
+
+}//first_pair
+
+//_____________________________________________________________________________
+void sim::pilot_ranges(double *vlo, double *vhi) {
+
+  //bin ranges around the region where the bunches overlap, from a pilot
+  //evolution of the first bunch pair over the crossing window with ncoarse
+  //bins along each axis in the volume swept by both bunches; the ranges cover
+  //the pairs except the tails below 1e-4 on each side plus one coarse bin,
+  //the bunches are restored after the pilot
+
+  bunch *b0, *b1;
+  first_pair(b0, b1);
 
-  TFile out("sim.root", "recreate");
+  double tmin, tmax, tc, sigt;
+  if( !crossing_window(b0, b1, tmin, tmax, tc, sigt) ) {
+    cout << "Bunches at rest in z, bin ranges from the configuration" << endl;
+    return;
+  }
+
+  //volume swept by each bunch from its extents at the ends of the window,
+  //the particles move along lines, and the intersection for the two bunches
+  double lo[3], hi[3];
+  for(int ia=0; ia<3; ia++) {
+    lo[ia] = -1e30;
+    hi[ia] = 1e30;
+  }
+
+  for(bunch *b: {b0, b1}) {
+
+    double elo[2][3], ehi[2][3];
+
+    b->get_extent(tmin, elo[0], ehi[0]);
+    b->get_extent(tmax, elo[1], ehi[1]);
+
+    for(int ia=0; ia<3; ia++) {
+      lo[ia] = max(lo[ia], min(elo[0][ia], elo[1][ia]));
+      hi[ia] = min(hi[ia], max(ehi[0][ia], ehi[1][ia]));
+    }
+  }
+
+  //pairs along x, y and z from the coarse densities at uniform steps in the window
+  int nc = ncoarse;
+  vector<double> proj[3];
+  for(int ia=0; ia<3; ia++) proj[ia].assign(nc+2, 0);
+
+  bool swept = true;
+  for(int ia=0; ia<3; ia++) swept = swept and lo[ia] < hi[ia];
+
+  //present state of the bunches, as for the checkpoints
+  FILE *f = tmpfile();
+  if( !f ) return;
+  b0->write_state(f);
+  b1->write_state(f);
+
+  if( swept ) {
+
+    for(bunch *b: {b0, b1}) {
+      b->set_bins(nc, lo[0], hi[0], nc, lo[1], hi[1], nc, lo[2], hi[2]);
+    }
+
+    const density& d0 = b0->get_dens();
+    const density& d1 = b1->get_dens();
+
+    int npilot = 2*nc;
+    double dt = (tmax-tmin)/npilot;
+
+    for(int istep=0; istep<npilot; istep++) {
+
+      double t = istep == 0 ? tmin + 0.5*dt : dt;
+      b0->move(t);
+      b1->move(t);
+
+      for(int ix=1; ix<nc+1; ix++) {
+        for(int iy=1; iy<nc+1; iy++) {
+          for(int iz=1; iz<nc+1; iz++) {
+
+            double npair = min(d0.get(ix, iy, iz), d1.get(ix, iy, iz));
+
+            proj[0][ix] += npair;
+            proj[1][iy] += npair;
+            proj[2][iz] += npair;
+          }
+        }
+      }
+    }
+  }
+
+  //bunches back to the state before the pilot
+  rewind(f);
+  b0->read_state(f);
+  b1->read_state(f);
+  fclose(f);
+
+  double sum = 0;
+  for(int i=1; i<nc+1; i++) sum += proj[0][i];
+
+  if( sum <= 0 ) {
+
+    //no overlap, bins over the swept volume if found
+    if( swept ) {
+      for(int ia=0; ia<3; ia++) {
+        vlo[ia] = lo[ia];
+        vhi[ia] = hi[ia];
+      }
+    }
+
+    cout << "No overlap in the pilot, bin ranges from " << (swept ? "the swept volume" : "the configuration") << endl;
+    return;
+  }
+
+  //coarse bins with the pairs without the tails, and one more bin on each side
+  for(int ia=0; ia<3; ia++) {
+
+    double w = (hi[ia]-lo[ia])/nc;
+
+    int i0 = 1, i1 = nc;
+    double c0 = proj[ia][i0], c1 = proj[ia][i1];
+    while( i0 < nc and c0 < 1e-4*sum ) c0 += proj[ia][++i0];
+    while( i1 > i0 and c1 < 1e-4*sum ) c1 += proj[ia][--i1];
+
+    vlo[ia] = lo[ia] + (i0-2)*w;
+    vhi[ia] = lo[ia] + (i1+1)*w;
+  }
+
+  cout << "Bin ranges from pilot (mm): x " << vlo[0] << " " << vhi[0] << ", y " << vlo[1] << " " << vhi[1];
+  cout << ", z " << vlo[2] << " " << vhi[2] << endl;
+
+}//pilot_ranges
+
+//_____________________________________________________________________________
+void sim::run_auto(int nstep, double frac) {
+
+  //evolution over the crossing window found from the bunches, with time nodes
+  //at quantiles of the expected overlap rate mixed with fraction frac of uniform
+  //rate, each step is weighted by its interval relative to the uniform step;
+  //with trains the steps are uniform in the crossing windows
+
+  //step intervals and the uniform step
+  vector<double> tlo, thi;
+  double dt_ref = 0;
+
+  if( trains() ) {
+
+    auto_train(nstep, tlo, thi);
+
+    if( tlo.empty() ) {
+      cout << "No bunch crossings, no evolution" << endl;
+      return;
+    }
+
+    for(size_t i=0; i<tlo.size(); i++) dt_ref += thi[i] - tlo[i];
+    dt_ref /= tlo.size();
+
+  } else {
+
+    double tmin, tmax, tc, sigt;
+    if( !crossing_window(bunches[0], bunches[1], tmin, tmax, tc, sigt) ) {
+      cout << "Bunches don't cross, no evolution" << endl;
+      return;
+    }
+
+    cout << "Crossing window (ns): " << tmin << " " << tmax << endl;
+
+    //cumulative rate, Gaussian truncated to the window plus uniform part
+    double g0 = TMath::Freq((tmin-tc)/sigt);
+    double g1 = TMath::Freq((tmax-tc)/sigt);
+
+    auto cdf = [&](double t) {
+      double fg = g1 > g0 ? (TMath::Freq((t-tc)/sigt) - g0)/(g1 - g0) : 0;
+      double fu = (t-tmin)/(tmax-tmin);
+      if( g1 <= g0 ) return fu;
+      return (1-frac)*fg + frac*fu;
+    };
+
+    //interval edges at the quantiles k/nstep by bisection
+    vector<double> edges(nstep+1);
+    edges[0] = tmin;
+    edges[nstep] = tmax;
+    for(int k=1; k<nstep; k++) {
+
+      double q = double(k)/nstep;
+      double a = edges[k-1], b = tmax;
+      for(int it=0; it<60; it++) {
+        double c = 0.5*(a+b);
+        if( cdf(c) < q ) {
+          a = c;
+        } else {
+          b = c;
+        }
+      }
+      edges[k] = 0.5*(a+b);
+    }
+
+    //window is from the present time
+    for(int k=0; k<nstep+1; k++) edges[k] += tcur;
+
+    tlo.assign(edges.begin(), edges.end()-1);
+    thi.assign(edges.begin()+1, edges.end());
+
+    dt_ref = (tmax-tmin)/nstep;
+  }
+
+  nstep = tlo.size();
+
+  //continue from a checkpoint of the same evolution if present,
+  //the intervals are part of the check
+  vector<double> par = tlo;
+  par.insert(par.end(), thi.begin(), thi.end());
+  par.push_back(frac);
+  int i0 = 0;
+  double tnow = tcur;
+
+  //present time of the bunches is restored with their state
+  if( read_checkpoint(1, par, i0, tnow) ) tcur = tnow;
+
+  //steps at interval centers
+  for(int i=i0; i<nstep; i++) {
+
+    double t = 0.5*(tlo[i] + thi[i]);
+
+    move(t - tnow);
+    tnow = t;
+
+    accumulate( step_weight(thi[i]-tlo[i], dt_ref) );
+
+    met.n_step++;
+    if( progress ) progress(i, nstep, t);
+
+    if( ckevery > 0 and (i+1) % ckevery == 0 and i+1 < nstep ) {
+      write_checkpoint(1, par, i+1, tnow);
+    }
+
+  }//steps
+
+  if( !outnam.empty() ) write(outnam.c_str());
+
+  end_checkpoint();
+
+}//run_auto
+
+//_____________________________________________________________________________
+void sim::write_checkpoint(int mode, const vector<double>& par, int istep, double tnow) {
+
+  //evolution mode and its parameters, next step, present time, time integrals,
+  //times and states of the bunches; written to a temporary file and renamed, so a checkpoint
+  //on disk is always complete
+
+  if( cknam.empty() ) return;
+
+  metrics_timer tio(met.t_io);
+
+  string tmp = cknam + ".tmp";
+  FILE *f = fopen(tmp.c_str(), "wb");
+  if( !f ) {
+    cout << "Can't write checkpoint " << tmp << endl;
+    return;
+  }
+
+  int npar = par.size();
+  int nb = bunches.size();
+
+  fwrite(ckmagic, 1, 8, f);
+  fwrite(&ckhash, sizeof(uint64_t), 1, f);
+  fwrite(&mode, sizeof(int), 1, f);
+  fwrite(&npar, sizeof(int), 1, f);
+  fwrite(par.data(), sizeof(double), npar, f);
+  fwrite(nbin, sizeof(int), 3, f);
+  fwrite(&nb, sizeof(int), 1, f);
+
+  fwrite(&istep, sizeof(int), 1, f);
+  fwrite(&tnow, sizeof(double), 1, f);
+
+  fwrite(vxt.data(), sizeof(double), vxt.size(), f);
+  fwrite(vyt.data(), sizeof(double), vyt.size(), f);
+  fwrite(vzt.data(), sizeof(double), vzt.size(), f);
+
+  fwrite(tb.data(), sizeof(double), nb, f);
+
+  for(auto i: bunches) {
+    i->write_state(f);
+  }
+
+  bool ok = fflush(f) == 0 and fsync(fileno(f)) == 0;
+  ok = (fclose(f) == 0) and ok;
+
+  if( !ok or rename(tmp.c_str(), cknam.c_str()) != 0 ) {
+    cout << "Can't write checkpoint " << cknam << endl;
+  }
+
+}//write_checkpoint
+
+//_____________________________________________________________________________
+bool sim::read_checkpoint(int mode, const vector<double>& par, int& istep, double& tnow) {
+
+  //state from a checkpoint made for the same configuration, mode, parameters and binning,
+  //false when there is no such checkpoint; called before the evolution moves the bunches,
+  //the configuration for the checkpoints written later is taken here
+
+  if( cknam.empty() ) return false;
+
+  ckhash = config_hash();
+
+  metrics_timer tio(met.t_io);
+
+  FILE *f = fopen(cknam.c_str(), "rb");
+  if( !f ) return false;
+
+  //header
+  char magic[8];
+  uint64_t fhash = 0;
+  int fmode = -1, npar = -1, fbin[3] = {-1, -1, -1}, nb = -1;
+
+  bool ok = fread(magic, 1, 8, f) == 8 and memcmp(magic, ckmagic, 8) == 0;
+  ok = ok and fread(&fhash, sizeof(uint64_t), 1, f) == 1 and fhash == ckhash;
+  ok = ok and fread(&fmode, sizeof(int), 1, f) == 1 and fmode == mode;
+  ok = ok and fread(&npar, sizeof(int), 1, f) == 1 and npar == (int)par.size();
+
+  vector<double> fpar(ok ? npar : 0);
+  ok = ok and fread(fpar.data(), sizeof(double), npar, f) == (size_t)npar and fpar == par;
+  ok = ok and fread(fbin, sizeof(int), 3, f) == 3;
+  ok = ok and fbin[0] == nbin[0] and fbin[1] == nbin[1] and fbin[2] == nbin[2];
+  ok = ok and fread(&nb, sizeof(int), 1, f) == 1 and nb == (int)bunches.size();
+
+  if( !ok ) {
+    cout << "Checkpoint " << cknam << " is for another configuration or evolution, starting from the beginning" << endl;
+    fclose(f);
+    return false;
+  }
+
+  //complete state is expected in the rest of the file
+  long pos = ftell(f);
+  fseek(f, 0, SEEK_END);
+  long nrest = ftell(f) - pos;
+  fseek(f, pos, SEEK_SET);
+
+  long nexp = sizeof(int) + sizeof(double) + sizeof(double)*(vxt.size() + vyt.size() + vzt.size() + tb.size());
+  for(auto i: bunches) {
+    nexp += sizeof(int) + 7*sizeof(double) + 3*sizeof(double)*(long)i->get_np();
+  }
+
+  if( nrest != nexp ) {
+    cout << "Checkpoint " << cknam << " is incomplete, starting from the beginning" << endl;
+    fclose(f);
+    return false;
+  }
+
+  //state
+  int fstep = 0;
+  double ft = 0;
+
+  ok = fread(&fstep, sizeof(int), 1, f) == 1 and fread(&ft, sizeof(double), 1, f) == 1;
+  ok = ok and fread(vxt.data(), sizeof(double), vxt.size(), f) == vxt.size();
+  ok = ok and fread(vyt.data(), sizeof(double), vyt.size(), f) == vyt.size();
+  ok = ok and fread(vzt.data(), sizeof(double), vzt.size(), f) == vzt.size();
+  ok = ok and fread(tb.data(), sizeof(double), tb.size(), f) == tb.size();
+
+  for(auto i: bunches) {
+    ok = ok and i->read_state(f);
+  }
+
+  fclose(f);
+
+  if( !ok ) {
+    cout << "Checkpoint " << cknam << " can't be read" << endl;
+    return false;
+  }
+
+  istep = fstep;
+  tnow = ft;
+
+  cout << "Resuming from checkpoint " << cknam << " at step " << istep << endl;
+
+  return true;
+
+}//read_checkpoint
+
+//_____________________________________________________________________________
+uint64_t sim::config_hash() {
+
+  //FNV-1a hash of the kernel, bin ranges and the initial state of the bunches,
+  //with their generation keys as in the bunch cache
+
+  string cfg;
+  char buf[512];
+
+  snprintf(buf, sizeof(buf), "%d %d %d %d %.17g %.17g %.17g %.17g %.17g %.17g;", kernel, nbin[0], nbin[1], nbin[2],
+    bmin[0], bmax[0], bmin[1], bmax[1], bmin[2], bmax[2]);
+  cfg += buf;
+
+  for(size_t i=0; i<bunches.size(); i++) {
+
+    bunch *b = bunches[i];
+    const TVector3& c = b->get_cen();
+    const TVector3& d = b->get_dir();
+
+    snprintf(buf, sizeof(buf), "%s %d %.17g %.17g %.17g %.17g %.17g %.17g %.17g %.17g %.17g %.17g %d %d %d;",
+      b->get_key().c_str(), side[i], tb[i], c.X(), c.Y(), c.Z(), d.X(), d.Y(), d.Z(), b->get_tilt(), b->get_vel(),
+      b->get_intensity(), b->get_hourglass(), b->get_shift(), b->get_dens().is_single());
+    cfg += buf;
+  }
+
+  uint64_t h = 14695981039346656037ULL;
+  for(unsigned char c: cfg) {
+    h ^= c;
+    h *= 1099511628211ULL;
+  }
+
+  return h;
+
+}//config_hash
+
+//_____________________________________________________________________________
+void sim::end_checkpoint() {
+
+  //checkpoint is not needed after the output is written
+
+  if( cknam.empty() ) return;
+
+  remove(cknam.c_str());
+
+}//end_checkpoint
+
+//_____________________________________________________________________________
+double sim::run_gaus(double tmin, double tmax) {
+
+  //analytic Gaussian overlap in place of the particle evolution, same binning
+  //and outputs, returns the total overlap in mm^-2; with trains for the first
+  //pair of bunches
+
+  gaus_overlap gaus;
+
+  TAxis *ax = hxt.GetXaxis();
+  TAxis *ay = hyt.GetXaxis();
+  TAxis *az = hzt.GetXaxis();
+
+  gaus.set_bins(ax->GetNbins(), ax->GetXmin(), ax->GetXmax(), ay->GetNbins(), ay->GetXmin(), ay->GetXmax(),
+    az->GetNbins(), az->GetXmin(), az->GetXmax());
+
+  bunch *b0, *b1;
+  first_pair(b0, b1);
+
+  gaus.run(b0, b1, tmin, tmax);
+
+  for(int i=0; i<nbin[0]+2; i++) vxt[i] = gaus.get_hxt().GetBinContent(i);
+  for(int i=0; i<nbin[1]+2; i++) vyt[i] = gaus.get_hyt().GetBinContent(i);
+  for(int i=0; i<nbin[2]+2; i++) vzt[i] = gaus.get_hzt().GetBinContent(i);
+
+  if( !outnam.empty() ) write(outnam.c_str());
+
+  return gaus.get_total();
+
+}//run_gaus
+
+//_____________________________________________________________________________
+void sim::write(const char *nam) {
+
+  metrics_timer tio(met.t_io);
+
+  fill_h1(hxt, vxt);
+  fill_h1(hyt, vyt);
+  fill_h1(hzt, vzt);
+
+  TFile out(nam, "recreate");
 
   hxt.Write("hxt");
   hyt.Write("hyt");
@@ -125,7 +1136,91 @@ void sim::run_evolution(double tmin, double tmax, int nstep) {
 
   out.Close();
 
-}//run_evolution
+}//write
+
+//_____________________________________________________________________________
+void sim::get_stats(int ia, double *stat) {
+
+  //sum, mean and RMS of the time integral along axis ia,
+  //bin centers without underflow and overflow
+
+  TAxis *ax[3] = {hxt.GetXaxis(), hyt.GetXaxis(), hzt.GetXaxis()};
+  const vector<double> *vt[3] = {&vxt, &vyt, &vzt};
+
+  double sw = 0, swx = 0, swx2 = 0;
+  for(int i=1; i<nbin[ia]+1; i++) {
+
+    double w = (*vt[ia])[i];
+    double x = ax[ia]->GetBinCenter(i);
+
+    sw += w;
+    swx += w*x;
+    swx2 += w*x*x;
+  }
+
+  stat[0] = sw;
+  stat[1] = 0;
+  stat[2] = 0;
+
+  if( sw <= 0 ) return;
+
+  stat[1] = swx/sw;
+  stat[2] = sqrt( max(0., swx2/sw - stat[1]*stat[1]) );
+
+}//get_stats
+
+//_____________________________________________________________________________
+void sim::get_metrics(sim_metrics& m) {
+
+  //timers and counters of the simulation with the sums over bunches
+
+  m = met;
+
+  for(auto i: bunches) {
+
+    const sim_metrics& b = i->get_metrics();
+
+    m.t_gen += b.t_gen;
+    m.t_fill += b.t_fill;
+    m.n_fill += b.n_fill;
+    m.n_in += b.n_in;
+    m.n_over += b.n_over;
+    m.mem_part += b.mem_part;
+    m.mem_dens += b.mem_dens;
+  }
+
+  //pairs distributions, partial sums and time integrals
+  m.mem_pairs = (vxy.capacity() + vz.capacity() + vxt.capacity() + vyt.capacity() + vzt.capacity())*sizeof(double);
+  for(const auto& i: vz_part) m.mem_pairs += i.capacity()*sizeof(double);
+
+}//get_metrics
+
+//_____________________________________________________________________________
+void sim::reset_metrics() {
+
+  //timers and counters to zero, the generation time in bunches is kept
+
+  met = sim_metrics();
+
+  for(auto i: bunches) {
+    i->reset_metrics(false);
+  }
+
+}//reset_metrics
+
+//_____________________________________________________________________________
+void sim::fill_h1(TH1D& h, const vector<double>& v) {
+
+  //histogram contents from array including underflow and overflow
+
+  h.Reset();
+
+  for(size_t i=0; i<v.size(); i++) {
+
+    h.SetBinContent(i, v[i]);
+  }
+
+}//fill_h1
 
 //_____________________________________________________________________________
 void sim::draw() {
@@ -140,6 +1235,15 @@ void sim::draw() {
 //_____________________________________________________________________________
 void sim::draw_xy() {
 
+  hxy.Reset();
+
+  for(int ix=0; ix<nbin[0]+2; ix++) {
+    for(int iy=0; iy<nbin[1]+2; iy++) {
+
+      hxy.SetBinContent(ix, iy, vxy[ix*(nbin[1]+2) + iy]);
+    }
+  }
+
   hxy.SetMinimum(0.98);
   hxy.SetMaximum(xymax);
   hxy.SetContour(300);
@@ -151,21 +1255,80 @@ void sim::draw_xy() {
 //_____________________________________________________________________________
 void sim::draw_z() {
 
+  fill_h1(hz, vz);
+
   hz.SetFillColor(kBlue);
 
   hz.Draw("same");
 
 }//draw_z
 
+//_____________________________________________________________________________
+void sim::draw_xt() {
+
+  fill_h1(hxt, vxt);
+
+  hxt.Draw();
+
+}//draw_xt
+
+//_____________________________________________________________________________
+void sim::draw_yt() {
+
+  fill_h1(hyt, vyt);
+
+  hyt.Draw();
+
+}//draw_yt
+
+//_____________________________________________________________________________
+void sim::draw_zt() {
+
+  fill_h1(hzt, vzt);
+
+  hzt.Draw();
+
+}//draw_zt
+
+//_____________________________________________________________________________
+int sim::get_hzmax() {
+
+  //maximum in z without underflow and overflow
+
+  double zmax = 0;
+  for(int iz=1; iz<nbin[2]+1; iz++) {
+    zmax = max(zmax, vz[iz]);
+  }
+
+  return zmax;
+
+}//get_hzmax
+
 //_____________________________________________________________________________
 extern "C" {
 
   sim *make_sim() { return new sim(); }
 
+  void sim_delete(sim *s) { delete s; }
+
   void sim_add_bunch(sim& s, bunch *b) { s.add_bunch(b); }
 
   void sim_move(sim& s, double dt) { s.move(dt); }
 
+  void sim_set_shift(sim& s, int nsub) { s.set_shift(nsub); }
+
+  void sim_set_single(sim& s, bool single) { s.set_single(single); }
+
+  void sim_set_nthreads(sim& s, int nthr) { s.set_nthreads(nthr); }
+
+  void sim_set_kernel(sim& s, int k) { s.set_kernel(k); }
+
+  void sim_set_adaptive(sim& s, int n) { s.set_adaptive(n); }
+
+  void sim_set_out(sim& s, const char *nam) { s.set_out(nam); }
+
+  void sim_set_checkpoint(sim& s, const char *nam, int every) { s.set_checkpoint(nam, every); }
+
   //void sim_set_bins(sim& s) { s.set_bins(); }
   void sim_set_bins(sim& s, int nx, double xmin, double xmax, int ny, double ymin, double ymax, int nz, double zmin, double zmax) {
     s.set_bins(nx, xmin, xmax, ny, ymin, ymax, nz, zmin, zmax);
@@ -175,6 +1338,8 @@ extern "C" {
 
   bunch *sim_get_bunch(sim& s, int id) { return s.get_bunch(id); }
 
+  int sim_get_nbunch(sim& s) { return s.get_nbunch(); }
+
   void sim_draw_xy(sim& s) { s.draw_xy(); }
 
   void sim_draw_z(sim& s) { s.draw_z(); }
@@ -183,6 +1348,37 @@ extern "C" {
 
   void sim_run_evolution(sim& s, double tmin, double tmax, int nstep) { s.run_evolution(tmin, tmax, nstep); }
 
+  void sim_run_auto(sim& s, int nstep, double frac) { s.run_auto(nstep, frac); }
+
+  //pairs in xy and z at each of nt times to the outputs, see sim::run_schedule
+  void sim_run_schedule(sim& s, const double *times, int nt, double *xy_out, double *z_out) {
+    s.run_schedule(times, nt, xy_out, z_out);
+  }
+
+  double sim_get_time(sim& s) { return s.get_time(); }
+
+  void sim_get_nbins(sim& s, int *n) { s.get_nbins(n); }
+
+  void sim_get_ranges(sim& s, double *lo, double *hi) { s.get_ranges(lo, hi); }
+
+  double sim_run_gaus(sim& s, double tmin, double tmax) { return s.run_gaus(tmin, tmax); }
+
+  void sim_get_stats(sim& s, int ia, double *stat) { s.get_stats(ia, stat); }
+
+  void sim_make_pairs(sim& s) { s.make_pairs(); }
+
+  void sim_get_metrics(sim& s, sim_metrics *m) { s.get_metrics(*m); }
+  void sim_reset_metrics(sim& s) { s.reset_metrics(); }
+
+  void sim_set_progress(sim& s, sim::progress_func f) { s.set_progress(f); }
+
+  //time integral along axis ia including underflow and overflow, returns number of bins + 2
+  int sim_get_integral(sim& s, int ia, double **val) {
+    std::vector<double>& v = s.get_integral(ia);
+    *val = v.data();
+    return v.size();
+  }
+
   void sim_draw_xt(sim& s) { s.draw_xt(); }
   void sim_draw_yt(sim& s) { s.draw_yt(); }
   void sim_draw_zt(sim& s) { s.draw_zt(); }
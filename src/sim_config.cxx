@@ -0,0 +1,142 @@
+
+//_____________________________________________________________________________
+//
+// Simulation from configuration
+//
+// Electron and proton/nucleus bunches made from the parameters in the cards,
+// with the crossing and vertical angles and the beam kinematics, put to a new
+// simulation with the binning, all in a single call. With nbunch above one the
+// simulation holds an electron and a proton/nucleus train with the bunches
+// at the given spacing in time. The configuration is
+// filled from a card by make_sim in python/beam_lib.py.
+//
+//_____________________________________________________________________________
+
+//C++
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+//ROOT
+#include "TGraph.h"
+#include "TVector3.h"
+#include "TRandom3.h"
+
+//local classes
+#include "bunch.h"
+#include "sim.h"
+#include "sim_config.h"
+
+using namespace std;
+
+//electron and proton masses, GeV, as in PDG
+static const double mass_e = 0.51099895e-3;
+static const double mass_p = 0.93827208816;
+
+//_____________________________________________________________________________
+sim *sim_from_config(const sim_config& c) {
+
+  sim *s = new sim();
+
+  //kinematics for electrons
+  double e_p = sqrt(c.Ee*c.Ee - mass_e*mass_e);
+
+  //kinematics for proton/nucleus
+  double nmass = mass_p*c.A;
+  double p_p = sqrt(c.Ep*c.Ep - mass_p*mass_p)*c.Z;
+  double p_en = sqrt(p_p*p_p + nmass*nmass);
+
+  //direction rotated along y by the crossing angle and then along x by the vertical angle
+  TVector3 dir(0, 0, 1);
+  dir.RotateY(-c.cross_angle*1e-3);
+  dir.RotateX(c.y_angle*1e-6);
+
+  //bunches in the trains, one bunch for single crossing
+  int nb = max(1, c.nbunch);
+  vector<bunch*> eb(nb), pb(nb);
+
+  //intensities varied along the trains, as bunch intensities for the luminosity
+  //from the product kernel, and as numbers of simulated particles for the minimum
+  //of the counts where the intensities are not used
+  vector<double> ef(nb, 1), pf(nb, 1);
+  if( nb > 1 ) {
+    TRandom3 rnd(c.seed);
+    for(int k=0; k<nb; k++) {
+      ef[k] = max(0., 1 + c.int_spread*rnd.Gaus());
+      pf[k] = max(0., 1 + c.int_spread*rnd.Gaus());
+    }
+  }
+  bool vary_np = c.kernel != 1;
+
+  for(int k=0; k<nb; k++) {
+
+    //independent seeds for all bunches, 2*seed and 2*seed+1 for the first pair
+    unsigned long seed = c.seed + 1000003UL*k;
+
+    //electron bunch
+    int e_np = vary_np ? lround(c.e_np*ef[k]) : c.e_np;
+    bunch *b1 = new bunch(e_np, c.e_rmsx, c.e_bsx, c.e_rmsy, c.e_bsy, c.e_rmsz, 2*seed, c.nthreads, c.cache_dir, c.cache_size, c.sampler);
+    b1->rotate_y(-c.cross_angle/2.);
+    b1->set_kinematics(c.Ee, e_p, 0, 0, -1);
+
+    //proton/nucleus bunch
+    int p_np = vary_np ? lround(c.p_np*pf[k]) : c.p_np;
+    bunch *b2 = new bunch(p_np, c.p_rmsx, c.p_bsx, c.p_rmsy, c.p_bsy, c.p_rmsz, 2*seed+1, c.nthreads, c.cache_dir, c.cache_size, c.sampler);
+    b2->set_color(kRed);
+    b2->rotate_y(-c.cross_angle/2.);
+    b2->set_kinematics(p_en, p_p, dir.x(), dir.y(), dir.z());
+
+    //transverse slopes for the hourglass
+    if( c.hourglass ) {
+      b1->set_hourglass();
+      b2->set_hourglass();
+    }
+
+    //bunch intensities for the luminosity
+    if( c.e_int > 0 ) b1->set_intensity(c.e_int);
+    if( c.p_int > 0 ) b2->set_intensity(c.p_int);
+    if( !vary_np ) {
+      b1->set_intensity( b1->get_intensity()*ef[k] );
+      b2->set_intensity( b2->get_intensity()*pf[k] );
+    }
+
+    eb[k] = b1;
+    pb[k] = b2;
+  }
+
+  if( nb == 1 ) {
+
+    //single crossing, proton/nucleus bunch is the first in the simulation
+    s->add_bunch(pb[0]);
+    s->add_bunch(eb[0]);
+
+  } else {
+
+    //bunch k in both trains reaches the interaction point at k times the spacing
+    for(int k=0; k<nb; k++) s->add_bunch(pb[k], 0, k*c.spacing);
+    for(int k=0; k<nb; k++) s->add_bunch(eb[k], 1, k*c.spacing);
+  }
+
+  s->set_nthreads(c.nthreads);
+  s->set_kernel(c.kernel);
+
+  if( c.single ) s->set_single(true);
+  if( c.nsub > 0 ) s->set_shift(c.nsub);
+  if( c.adaptive > 0 ) s->set_adaptive(c.adaptive);
+
+  s->set_bins(c.nx, c.xmin, c.xmax, c.ny, c.ymin, c.ymax, c.nz, c.zmin, c.zmax);
+
+  if( c.checkpoint ) s->set_checkpoint(c.checkpoint, c.checkpoint_every);
+
+  return s;
+
+}//sim_from_config
+
+//_____________________________________________________________________________
+extern "C" {
+
+  //simulation with the bunches from the configuration
+  sim *sim_setup(const sim_config *c) { return sim_from_config(*c); }
+
+}
+